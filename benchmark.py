@@ -0,0 +1,422 @@
+from typing import Callable
+
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import multiprocessing
+
+import numpy as np
+import torch
+
+from torchvision.transforms import transforms
+
+from sklearn.preprocessing import LabelEncoder
+
+from preprocessing import (
+    AdjustContrast, load_split, image_to_torch, extract_labels, create_torch_dataset, create_dataloader
+)
+
+
+def measure_peak_memory(fn: Callable, *args, **kwargs) -> dict:
+    """
+    Run a function in a forked process and measure its peak memory.
+    The function must return a torch.Tensor.
+    Returns the peak resident memory increase, the output size and their ratio, in bytes.
+
+    Parameters
+    ----------
+    fn : Callable
+        Function to benchmark
+    *args, **kwargs
+        Arguments of the function
+
+    Returns
+    -------
+    dict
+
+    Example
+    -------
+    >>> measure_peak_memory(image_to_torch, dataset=dataset, transform=preprocess_transform)
+    {'peak_bytes': 805502976, 'output_bytes': 786432000, 'ratio': 1.02}
+    """
+    # Forked process: the peak memory is not polluted by previous allocations of this process
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_measure_in_child, args=(queue, fn, args, kwargs))
+    process.start()
+    result = queue.get()
+    process.join()
+
+    return result
+
+
+def _measure_in_child(queue, fn, args, kwargs):
+    """
+    Measure peak memory of fn in the current process and send it through the queue.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    output = fn(*args, **kwargs)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    output_bytes = output.nelement() * output.element_size()
+    queue.put({
+        'peak_bytes': peak_rss - start_rss,
+        'output_bytes': output_bytes,
+        'ratio': round((peak_rss - start_rss) / output_bytes, 2)
+    })
+
+
+def reference_image_to_torch(dataset, transform) -> torch.Tensor:
+    """
+    Former image_to_torch implementation (list, then numpy array, then tensor), kept as a memory baseline.
+    """
+    return torch.from_numpy(
+        np.array(
+            [transform(dataset[idx]['image']) for idx in range(len(dataset))]
+        )
+    )
+
+
+def benchmark_image_to_torch_memory(
+        dataset,
+        transform: transforms,
+        compact: bool = False,
+        num_proc: int = None
+    ) -> dict:
+    """
+    Compare peak memory of image_to_torch against the list -> numpy -> torch baseline.
+
+    Parameters
+    ----------
+    dataset : datasets.Dataset
+        HuggingFace dataset
+    transform : transforms
+        Preprocess transformations
+    compact : bool, default False
+        Store images as uint8 pixels
+    num_proc : int, default None
+        Number of preprocessing processes
+
+    Returns
+    -------
+    dict
+    """
+    return {
+        'reference': measure_peak_memory(reference_image_to_torch, dataset, transform),
+        'image_to_torch': measure_peak_memory(
+            image_to_torch, dataset=dataset, transform=transform, compact=compact, num_proc=num_proc
+        )
+    }
+
+
+def default_train_transform() -> transforms:
+    """
+    Data augmentation of the minority classes used in the notebook.
+    """
+    return transforms.Compose([
+        transforms.RandomChoice([
+            transforms.RandomHorizontalFlip(p=1),
+            transforms.RandomRotation(degrees=(0, 180)),
+            AdjustContrast(contrast_factor=0.90),
+            AdjustContrast(contrast_factor=1.10)
+        ])
+    ])
+
+
+def _run_stage(fn: Callable, n_images: int, repeats: int = 5) -> tuple:
+    """
+    Run one benchmark stage repeats times and return its output and its measures.
+    wall_time and images_per_sec are those of the fastest run, the first runs also warming up caches.
+    peak_rss is the peak increase of resident memory while the stage runs, in bytes (see _stage_peak_rss).
+    """
+    wall_times = []
+    for _ in range(repeats):
+        # Same random augmentations and shuffling in every run, so every run does the same work
+        torch.manual_seed(0)
+        random.seed(0)
+        start = time.perf_counter()
+        output = fn()
+        wall_times.append(time.perf_counter() - start)
+    wall_time = min(wall_times)
+
+    return output, {
+        'wall_time': round(wall_time, 4),
+        'wall_time_median': round(float(np.median(wall_times)), 4),
+        'images_per_sec': round(n_images / wall_time, 2) if n_images > 0 and wall_time > 0 else None,
+        'peak_rss': _stage_peak_rss(fn),
+        'n_images': n_images
+    }
+
+
+def _stage_peak_rss(fn: Callable) -> int:
+    """
+    Run a stage once more in a forked process and return its peak resident memory increase, in bytes.
+    The peak memory of a forked process starts from its current memory, so the measure does not include
+    the peak of previous stages, unlike the peak memory of the benchmark process.
+    DataLoader worker processes are not included.
+    """
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_stage_peak_rss_in_child, args=(queue, fn))
+    process.start()
+    peak_rss = queue.get()
+    process.join()
+
+    return peak_rss
+
+
+def _stage_peak_rss_in_child(queue, fn):
+    """
+    Measure the peak memory increase of fn in the current process and send it through the queue.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    torch.manual_seed(0)
+    random.seed(0)
+    fn()
+    queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - start_rss)
+
+
+def benchmark_pipeline(
+        dataset: str,
+        part_set: str = 'train',
+        preprocess_transform: transforms = None,
+        transform: transforms = None,
+        minority_classes: list = (0, 3, 6),
+        limit: int = None,
+        n_getitem: int = 1000,
+        batch_size: int = 64,
+        num_workers: int = 0,
+        compact: bool = False,
+        num_proc: int = None,
+        repeats: int = 5
+    ) -> dict:
+    """
+    Measure the data pipeline stage by stage: load_dataset, image_to_torch, extract_labels,
+    CustomDataset.__getitem__ without and with augmentation, and one DataLoader epoch.
+    Each stage reports its wall time, images per second and its peak resident memory increase.
+
+    Parameters
+    ----------
+    dataset : str
+        HuggingFace dataset name, local directory or save_to_disk directory (see synthetic.py)
+    part_set : {'train', 'validation', 'test'}, default 'train'
+        Part set to load
+    preprocess_transform : transforms, default None
+        Preprocess transformations. Defaults to a 256x256 Resize and ToTensor.
+    transform : transforms, default None
+        Data augmentation. Defaults to the notebook augmentation, see default_train_transform.
+    minority_classes : list, default (0, 3, 6)
+        Augmented classes of the DataLoader stage
+    limit : int, default None
+        Number of images of the part set to use
+    n_getitem : int, default 1000
+        Number of __getitem__ calls of each __getitem__ stage
+    batch_size : int, default 64
+        Batch size of the DataLoader stage
+    num_workers : int, default 0
+        Number of workers of the DataLoader stage
+    compact : bool, default False
+        Store images as uint8 pixels
+    num_proc : int, default None
+        Number of preprocessing processes
+    repeats : int, default 5
+        Number of timed runs of each stage, the fastest is reported
+
+    Returns
+    -------
+    dict
+
+    Example
+    -------
+    >>> results = benchmark_pipeline('synthetic_1x/huggingface', limit=2000)
+    >>> results['stages']['image_to_torch']
+    {'wall_time': 9.81, 'wall_time_median': 9.93, 'images_per_sec': 203.87, 'peak_rss': 1612709888, 'n_images': 2000}
+    """
+    if preprocess_transform is None:
+        preprocess_transform = transforms.Compose([
+            transforms.Resize(size=(256, 256)),
+            transforms.ToTensor()
+        ])
+    if transform is None:
+        transform = default_train_transform()
+
+    stages = {}
+
+    data, stages['load_dataset'] = _run_stage(lambda: load_split(dataset, part_set), 0, repeats)
+    if limit is not None:
+        data = data.select(range(min(limit, len(data))))
+    n = len(data)
+    stages['load_dataset']['n_images'] = n
+
+    images, stages['image_to_torch'] = _run_stage(
+        lambda: image_to_torch(data, preprocess_transform, compact=compact, num_proc=num_proc), n, repeats
+    )
+    label_encoder = LabelEncoder()
+    labels, stages['extract_labels'] = _run_stage(lambda: extract_labels(data, label_encoder), n, repeats)
+
+    indices = torch.randint(n, (n_getitem,), generator=torch.Generator().manual_seed(0)).tolist()
+    all_classes = list(range(len(label_encoder.classes_)))
+    # Train set without minority classes: images are only cropped
+    for stage, augmented_classes in (('getitem', []), ('getitem_augment', all_classes)):
+        custom_dataset = create_torch_dataset(images, labels, 'train', augmented_classes, True, transform)
+        _, stages[stage] = _run_stage(lambda: [custom_dataset[idx] for idx in indices], n_getitem, repeats)
+
+    dataloader = create_dataloader(
+        dataset=create_torch_dataset(images, labels, 'train', list(minority_classes), True, transform),
+        batch_size=batch_size,
+        shuffle=True,
+        num_workers=num_workers
+    )
+    _, stages['dataloader'] = _run_stage(lambda: [len(batch['label']) for batch in dataloader], n, repeats)
+
+    return {
+        'config': {
+            'dataset': dataset,
+            'part_set': part_set,
+            'n_images': n,
+            'preprocess_transform': repr(preprocess_transform),
+            'transform': repr(transform),
+            'minority_classes': list(minority_classes),
+            'n_getitem': n_getitem,
+            'batch_size': batch_size,
+            'num_workers': num_workers,
+            'compact': compact,
+            'num_proc': num_proc
+        },
+        'stages': stages
+    }
+
+
+def compare_to_baseline(
+        results: dict,
+        baseline: dict,
+        tolerance: float = 0.1,
+        min_time: float = 0.005,
+        min_rss: int = 16 * 2**20
+    ) -> list:
+    """
+    Compare benchmark_pipeline results with baseline results of the same configuration.
+    A stage regresses if its throughput is lower, or its peak memory higher, than the baseline by more than tolerance.
+    Differences smaller than min_time seconds or min_rss bytes are measurement noise and never flagged.
+
+    Parameters
+    ----------
+    results : dict
+        Results of benchmark_pipeline
+    baseline : dict
+        Baseline results of benchmark_pipeline
+    tolerance : float, default 0.1
+        Relative tolerance
+    min_time : float, default 0.005
+        Smallest wall time difference flagged, in seconds
+    min_rss : int, default 16 MiB
+        Smallest peak memory difference flagged, in bytes
+
+    Returns
+    -------
+    list : Regressions, empty if none
+    """
+    # Measures of another configuration are not comparable
+    differences = {
+        key: (baseline['config'].get(key), value) for key, value in results['config'].items()
+        if baseline['config'].get(key) != value
+    }
+    if differences:
+        raise ValueError(f"Results and baseline configurations differ (baseline, results): {differences}")
+
+    regressions = []
+    for stage, measures in results['stages'].items():
+        reference = baseline['stages'].get(stage)
+        if reference is None:
+            continue
+
+        slower = measures['wall_time'] - reference['wall_time'] > min_time
+        # Stages without a throughput (load_dataset) are compared on wall time
+        if measures['images_per_sec'] is not None and reference['images_per_sec']:
+            if slower and measures['images_per_sec'] < reference['images_per_sec'] * (1 - tolerance):
+                regressions.append({
+                    'stage': stage, 'measure': 'images_per_sec',
+                    'baseline': reference['images_per_sec'], 'value': measures['images_per_sec']
+                })
+        elif slower and measures['wall_time'] > reference['wall_time'] * (1 + tolerance):
+            regressions.append({
+                'stage': stage, 'measure': 'wall_time',
+                'baseline': reference['wall_time'], 'value': measures['wall_time']
+            })
+
+        if measures['peak_rss'] - reference['peak_rss'] > min_rss and \
+                measures['peak_rss'] > reference['peak_rss'] * (1 + tolerance):
+            regressions.append({
+                'stage': stage, 'measure': 'peak_rss',
+                'baseline': reference['peak_rss'], 'value': measures['peak_rss']
+            })
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Data pipeline benchmarks.")
+    parser.add_argument('--mode', choices=['memory', 'pipeline'], default='memory',
+                        help="memory: peak memory of image_to_torch, pipeline: throughput of every stage")
+    parser.add_argument('--dataset', default='marmal88/skin_cancer')
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--size', type=int, default=256, help="Images are resized to size x size")
+    parser.add_argument('--limit', type=int, default=None, help="Number of images to preprocess")
+    parser.add_argument('--compact', action='store_true')
+    parser.add_argument('--num-proc', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--num-workers', type=int, default=0)
+    parser.add_argument('--n-getitem', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=5, help="Timed runs of each stage (pipeline mode)")
+    parser.add_argument('--baseline', default=None, help="Baseline JSON to compare with (pipeline mode)")
+    parser.add_argument('--save-baseline', default=None, help="Write the results as baseline JSON (pipeline mode)")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    preprocess_transform = transforms.Compose([
+        transforms.Resize(size=(args.size, args.size)),
+        transforms.ToTensor()
+    ])
+
+    if args.mode == 'memory':
+        dataset = load_split(args.dataset, args.split)
+        if args.limit is not None:
+            dataset = dataset.select(range(min(args.limit, len(dataset))))
+
+        results = benchmark_image_to_torch_memory(
+            dataset=dataset,
+            transform=preprocess_transform,
+            compact=args.compact,
+            num_proc=args.num_proc
+        )
+        print(json.dumps(results, indent=2))
+        sys.exit(0)
+
+    results = benchmark_pipeline(
+        dataset=args.dataset,
+        part_set=args.split,
+        preprocess_transform=preprocess_transform,
+        limit=args.limit,
+        n_getitem=args.n_getitem,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        compact=args.compact,
+        num_proc=args.num_proc,
+        repeats=args.repeats
+    )
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            results['regressions'] = compare_to_baseline(results, json.load(f), args.tolerance)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    print(json.dumps(results, indent=2))
+    # Non-zero exit code on regression, to fail a CI job
+    sys.exit(1 if results.get('regressions') else 0)
@@ -0,0 +1,563 @@
+from typing import Tuple, Union
+
+import os
+import json
+import fcntl
+import bisect
+import hashlib
+import weakref
+import warnings
+
+import numpy as np
+import torch
+
+from torchvision.transforms import transforms
+
+from sklearn.preprocessing import LabelEncoder
+
+
+CACHE_VERSION = 1
+
+# Address ranges of the memory-mapped cache tensors, see is_memory_mapped
+_mapped_ranges = {}
+
+
+def cache_key(
+        dataset: str,
+        part_set: str,
+        preprocess_transform: transforms,
+        compact: bool = False,
+        draft: bool = False
+    ) -> str:
+    """
+    Return the cache key of a preprocessed split.
+    The key is a hash of the dataset name, the part set and the preprocess transformations.
+
+    Parameters
+    ----------
+    dataset : str
+        HuggingFace dataset name
+    part_set : {'train', 'validation', 'test'}
+        Train, validation or test set
+    preprocess_transform : transforms
+        Transformations applied to every image before caching
+    compact : bool, default False
+        True if images are stored as uint8 pixels
+    draft : bool, default False
+        True if JPEG images are decoded at a reduced scale
+
+    Returns
+    -------
+    str
+
+    Example
+    -------
+    >>> preprocess_transform = transforms.Compose([
+    >>>     transforms.Resize(size=(256, 256)),
+    >>>     transforms.ToTensor()
+    >>> ])
+    >>> cache_key('marmal88/skin_cancer', 'train', preprocess_transform)
+    'marmal88_skin_cancer-train-b054072ad042757b'
+    """
+    # The transform representation lists every transformation with its parameters
+    fingerprint = json.dumps({
+        'version': CACHE_VERSION,
+        'dataset': dataset,
+        'part_set': part_set,
+        'preprocess_transform': repr(preprocess_transform),
+        'compact': compact,
+        'draft': draft
+    }, sort_keys=True)
+    digest = hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+    name = str(dataset).strip('/').replace('/', '_')
+
+    return f"{name}-{part_set}-{digest}"
+
+
+def save_cached_split(
+        cache_dir: str,
+        key: str,
+        images: torch.Tensor,
+        labels: torch.Tensor,
+        label_encoder: LabelEncoder
+    ) -> str:
+    """
+    Write preprocessed images and encoded labels to the cache directory.
+    Files are written under a temporary name then renamed, so a reader never sees a partial cache.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache root directory
+    key : str
+        Cache key, see cache_key
+    images : torch.Tensor
+        Preprocessed images
+    labels : torch.Tensor
+        Encoded labels
+    label_encoder : LabelEncoder
+        Fitted label encoder used to encode the labels
+
+    Returns
+    -------
+    str : Path of the cache entry
+    """
+    path = os.path.join(cache_dir, key)
+    os.makedirs(path, exist_ok=True)
+
+    # Write the images directly into a memory-mapped .npy file
+    tmp_images = os.path.join(path, f"images.npy.{os.getpid()}.tmp")
+    array = np.lib.format.open_memmap(
+        tmp_images, mode='w+', dtype=images.numpy().dtype, shape=tuple(images.shape)
+    )
+    array[:] = images.numpy()
+    array.flush()
+    del array
+
+    tmp_labels = os.path.join(path, f"labels.npy.{os.getpid()}.tmp")
+    with open(tmp_labels, 'wb') as f:
+        np.save(f, labels.numpy().astype(np.int64))
+
+    tmp_meta = os.path.join(path, f"meta.json.{os.getpid()}.tmp")
+    with open(tmp_meta, 'w') as f:
+        json.dump({
+            'version': CACHE_VERSION,
+            'classes': [str(c) for c in label_encoder.classes_],
+            'num_samples': int(images.size(0))
+        }, f)
+
+    os.replace(tmp_images, os.path.join(path, 'images.npy'))
+    os.replace(tmp_labels, os.path.join(path, 'labels.npy'))
+    # meta.json is written last and marks the entry as complete
+    os.replace(tmp_meta, os.path.join(path, 'meta.json'))
+
+    return path
+
+
+def load_cached_split(
+        cache_dir: str,
+        key: str,
+        label_encoder: LabelEncoder
+    ) -> Union[Tuple[torch.Tensor, torch.Tensor], None]:
+    """
+    Open a cached split without copying it in memory.
+    Images are memory-mapped in copy-on-write mode, so every process opening the same
+    cache entry shares the same physical pages.
+    Return None if the split is not cached.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache root directory
+    key : str
+        Cache key, see cache_key
+    label_encoder : LabelEncoder
+        Label encoder. Fitted on the cached classes if not fitted yet.
+
+    Returns
+    -------
+    (torch.Tensor, torch.Tensor) or None
+    """
+    path = os.path.join(cache_dir, key)
+    meta_path = os.path.join(path, 'meta.json')
+
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    if meta.get('version') != CACHE_VERSION:
+        return None
+
+    # If label encoder first time met labels, reuse the cached classes
+    if not hasattr(label_encoder, 'classes_'):
+        set_label_classes(label_encoder, meta['classes'])
+    # Classes of appended segments unknown to the label encoder are added after its own classes
+    else:
+        known = set(str(c) for c in label_encoder.classes_)
+        unknown = [c for c in meta['classes'] if c not in known]
+        if unknown:
+            warnings.warn(
+                f"Classes {unknown} of the cache entry {key} are unknown to the label encoder, "
+                f"they are added after its classes"
+            )
+            extend_label_encoder(label_encoder, unknown)
+
+    segments_images, segments_labels = [], []
+    for segment in _segments(meta):
+        images = torch.from_numpy(np.load(os.path.join(path, segment['images']), mmap_mode='c'))
+        _register_mapped(images)
+        segments_images.append(images)
+
+        # Each segment is encoded with the classes known when it was written
+        codes = np.load(os.path.join(path, segment['labels']))
+        lookup = label_encoder.transform(np.array(segment['classes'])).astype(np.int64)
+        segments_labels.append(torch.from_numpy(lookup[codes]))
+
+    if len(segments_images) == 1:
+        return segments_images[0], segments_labels[0]
+
+    return SegmentedImages(segments_images), torch.cat(segments_labels)
+
+
+def append_cached_split(
+        cache_dir: str,
+        key: str,
+        images: torch.Tensor,
+        labels: torch.Tensor,
+        label_encoder: LabelEncoder
+    ) -> str:
+    """
+    Append preprocessed images and encoded labels to an existing cache entry, as a new segment.
+    Existing segments are not rewritten: appending costs as much as writing the new samples.
+    New classes are added after the cached classes, so the codes of the cached classes do not change.
+    The segment files are written first and meta.json is replaced last, so a reader sees
+    either the previous entry or the whole union. Concurrent appends to the same entry take turns
+    on a lock file, so that none of them is lost.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache root directory
+    key : str
+        Cache key, see cache_key
+    images : torch.Tensor
+        New preprocessed images, with the same shape and type as the cached ones
+    labels : torch.Tensor
+        New labels, encoded by label_encoder
+    label_encoder : LabelEncoder
+        Fitted label encoder used to encode the new labels. It may know classes the cache does not.
+
+    Returns
+    -------
+    str : Path of the cache entry
+    """
+    path = os.path.join(cache_dir, key)
+    meta_path = os.path.join(path, 'meta.json')
+
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"No cache entry {key} in {cache_dir}, use save_cached_split first")
+
+    # The lock is held from reading meta.json to replacing it, and released if the process dies
+    with open(os.path.join(path, 'meta.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        segments = _segments(meta)
+        segment = len(segments)
+        segment_classes = [str(c) for c in label_encoder.classes_]
+
+        tmp_images = os.path.join(path, f"images-{segment:06d}.npy.{os.getpid()}.tmp")
+        array = np.lib.format.open_memmap(
+            tmp_images, mode='w+', dtype=images.numpy().dtype, shape=tuple(images.shape)
+        )
+        array[:] = images.numpy()
+        array.flush()
+        del array
+
+        tmp_labels = os.path.join(path, f"labels-{segment:06d}.npy.{os.getpid()}.tmp")
+        with open(tmp_labels, 'wb') as f:
+            np.save(f, labels.numpy().astype(np.int64))
+
+        os.replace(tmp_images, os.path.join(path, f"images-{segment:06d}.npy"))
+        os.replace(tmp_labels, os.path.join(path, f"labels-{segment:06d}.npy"))
+
+        segments.append({
+            'images': f"images-{segment:06d}.npy",
+            'labels': f"labels-{segment:06d}.npy",
+            'classes': segment_classes,
+            'num_samples': int(images.size(0))
+        })
+
+        tmp_meta = os.path.join(path, f"meta.json.{os.getpid()}.tmp")
+        with open(tmp_meta, 'w') as f:
+            json.dump({
+                'version': CACHE_VERSION,
+                'classes': meta['classes'] + [c for c in segment_classes if c not in meta['classes']],
+                'num_samples': sum(s['num_samples'] for s in segments),
+                'segments': segments
+            }, f)
+        os.replace(tmp_meta, meta_path)
+
+    return path
+
+
+def _segments(meta: dict) -> list:
+    """
+    Return the segments of a cache entry. Entries never appended to have a single segment.
+    """
+    if 'segments' in meta:
+        return meta['segments']
+
+    return [{
+        'images': 'images.npy',
+        'labels': 'labels.npy',
+        'classes': meta['classes'],
+        'num_samples': meta['num_samples']
+    }]
+
+
+def load_cached_classes(cache_dir: str, key: str) -> Union[list, None]:
+    """
+    Return the classes of a cache entry, in encoding order. None if the split is not cached.
+    """
+    meta_path = os.path.join(cache_dir, key, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path) as f:
+        return json.load(f)['classes']
+
+
+def set_label_classes(label_encoder: LabelEncoder, classes: list) -> LabelEncoder:
+    """
+    Set the classes of a label encoder, in the given order: classes[i] is encoded as i.
+    Sorted classes give the same encoder as fit. Otherwise classes are stored as an object array,
+    which the label encoder encodes with a lookup table instead of a binary search.
+
+    Parameters
+    ----------
+    label_encoder : LabelEncoder
+        Label encoder, fitted or not
+    classes : list
+        Classes in encoding order
+
+    Returns
+    -------
+    LabelEncoder
+    """
+    classes = [str(c) for c in classes]
+    if classes == sorted(classes):
+        label_encoder.fit(np.array(classes))
+    else:
+        label_encoder.classes_ = np.array(classes, dtype=object)
+
+    return label_encoder
+
+
+def extend_label_encoder(label_encoder: LabelEncoder, labels) -> LabelEncoder:
+    """
+    Add unknown labels to a fitted label encoder, after its classes.
+    Codes of the known classes never change, so tensors and checkpoints using them stay valid.
+    The classes are not sorted anymore if a new class sorts before a known one.
+
+    Parameters
+    ----------
+    label_encoder : LabelEncoder
+        Fitted label encoder
+    labels : array-like
+        Labels, known or not. Unknown labels are added in their order of first appearance.
+
+    Returns
+    -------
+    LabelEncoder
+    """
+    classes = [str(c) for c in label_encoder.classes_]
+    known = set(classes)
+    # Distinct labels, in order of first appearance
+    labels = dict.fromkeys(str(label) for label in np.asarray(labels).tolist())
+    missing = [label for label in labels if label not in known]
+    if missing:
+        set_label_classes(label_encoder, classes + missing)
+
+    return label_encoder
+
+
+class SegmentedImages:
+    """
+    Images of a cache entry made of several segments, indexed as one tensor.
+    Segments stay memory-mapped and are never concatenated in memory.
+    """
+    def __init__(self, segments: list):
+        self.segments = segments
+        # Index of the first image of each segment
+        self.starts = np.cumsum([0] + [len(segment) for segment in segments]).tolist()
+
+    @property
+    def shape(self):
+        return torch.Size((self.starts[-1], *self.segments[0].shape[1:]))
+
+    @property
+    def dtype(self):
+        return self.segments[0].dtype
+
+    def __len__(self):
+        return self.starts[-1]
+
+    def __getitem__(self, idx):
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"index {idx} is out of range")
+        segment = bisect.bisect_right(self.starts, idx) - 1
+
+        return self.segments[segment][idx - self.starts[segment]]
+
+    def share_memory(self):
+        # Segments are memory-mapped, already shared through the page cache
+        return self
+
+
+def is_memory_mapped(tensor: torch.Tensor) -> bool:
+    """
+    Return True if the tensor (or a view of it) is a memory-mapped cache tensor.
+    Such tensors are already shared between processes by the page cache.
+    """
+    ptr = tensor.data_ptr()
+    return any(start <= ptr < end for start, end in _mapped_ranges.values())
+
+
+def _register_mapped(tensor: torch.Tensor) -> None:
+    """
+    Record the address range of a memory-mapped tensor until it is garbage collected.
+    """
+    key = id(tensor)
+    _mapped_ranges[key] = (tensor.data_ptr(), tensor.data_ptr() + tensor.nelement() * tensor.element_size())
+    weakref.finalize(tensor, _mapped_ranges.pop, key, None)
+
+
+def augmentation_key(
+        key: str,
+        transform: transforms,
+        n_variants: int,
+        augment_mask: torch.Tensor,
+        seed: int = 0
+    ) -> str:
+    """
+    Return the cache key of the precomputed augmentations of a cached split.
+    The key depends on which samples are augmented, so another choice of minority classes,
+    or samples appended to the split, give another key.
+
+    Parameters
+    ----------
+    key : str
+        Cache key of the split, see cache_key
+    transform : transforms
+        Data augmentation transformations
+    n_variants : int
+        Number of variants per image
+    augment_mask : torch.Tensor
+        True for the augmented samples of the split
+    seed : int, default 0
+        Random seed of the augmentations
+
+    Returns
+    -------
+    str
+    """
+    fingerprint = json.dumps({
+        'version': CACHE_VERSION,
+        'transform': repr(transform),
+        'n_variants': n_variants,
+        'augment_mask': hashlib.sha256(np.packbits(augment_mask.numpy()).tobytes()).hexdigest(),
+        'num_samples': len(augment_mask),
+        'seed': seed
+    }, sort_keys=True)
+    digest = hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+
+    return f"{key}-augment-{digest}"
+
+
+def compression_key(key: str, image_format: str, quality: int, num_samples: int) -> str:
+    """
+    Return the cache key of the encoded images of a cached split, see CompressedImages.
+    The number of samples is part of the key, so samples appended to the split give another key.
+
+    Parameters
+    ----------
+    key : str
+        Cache key of the split, see cache_key
+    image_format : str
+        Image encoding
+    quality : int
+        JPEG and WebP quality
+    num_samples : int
+        Number of images of the split
+
+    Returns
+    -------
+    str
+    """
+    fingerprint = json.dumps({
+        'version': CACHE_VERSION,
+        'image_format': image_format.lower(),
+        # PNG ignores the quality
+        'quality': None if image_format.lower() == 'png' else quality,
+        'num_samples': num_samples
+    }, sort_keys=True)
+    digest = hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+
+    return f"{key}-compress-{digest}"
+
+
+def save_compressed_images(cache_dir: str, key: str, buffer: torch.Tensor, offsets: torch.Tensor) -> str:
+    """
+    Write the buffer and offsets of encoded images to the cache directory, see CompressedImages.
+    Files are written under a temporary name then renamed, meta.json last, as in save_cached_split.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache root directory
+    key : str
+        Cache key, see compression_key
+    buffer : torch.Tensor
+        uint8, all encoded images
+    offsets : torch.Tensor
+        int64, position of each image in the buffer
+
+    Returns
+    -------
+    str : Path of the cache entry
+    """
+    path = os.path.join(cache_dir, key)
+    os.makedirs(path, exist_ok=True)
+
+    for name, tensor in (('buffer', buffer), ('offsets', offsets)):
+        tmp_path = os.path.join(path, f"{name}.npy.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            np.save(f, tensor.numpy())
+        os.replace(tmp_path, os.path.join(path, f"{name}.npy"))
+
+    tmp_meta = os.path.join(path, f"meta.json.{os.getpid()}.tmp")
+    with open(tmp_meta, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'num_samples': int(offsets.size(0)) - 1}, f)
+    os.replace(tmp_meta, os.path.join(path, 'meta.json'))
+
+    return path
+
+
+def load_compressed_images(cache_dir: str, key: str) -> Union[Tuple[torch.Tensor, torch.Tensor], None]:
+    """
+    Open the buffer and offsets of cached encoded images, the buffer memory-mapped.
+    Return None if they are not cached.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache root directory
+    key : str
+        Cache key, see compression_key
+
+    Returns
+    -------
+    (torch.Tensor, torch.Tensor) or None
+    """
+    path = os.path.join(cache_dir, key)
+    meta_path = os.path.join(path, 'meta.json')
+
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path) as f:
+        if json.load(f).get('version') != CACHE_VERSION:
+            return None
+
+    buffer = torch.from_numpy(np.load(os.path.join(path, 'buffer.npy'), mmap_mode='c'))
+    _register_mapped(buffer)
+    offsets = torch.from_numpy(np.load(os.path.join(path, 'offsets.npy')))
+
+    return buffer, offsets
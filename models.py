@@ -242,7 +242,8 @@ def train_model(
         optimizer: torch.optim,
         epoch: int, 
         save: bool, 
-        verbose: int
+        verbose: int,
+        loss_tracker: 'LossTracker' = None
     ) -> Tuple[float]:
     """
     Train a model with the specified optimizer and loss function, over the number of epochs.
@@ -268,6 +269,8 @@ def train_model(
         Print loss and accuracy
         * 1 : For each n batches
         * 2 : For each n batches and for each epoch
+    loss_tracker : LossTracker, default None
+        Records the cross-entropy loss of every sample, by dataset position (see preprocessing.LossPruningSampler)
 
     Returns
     -------
@@ -294,17 +297,31 @@ def train_model(
     # Set model in training mode
     model.train()
 
-    losses, corrects = [], 0
+    losses, corrects, n_samples = [], 0, 0
+    # Samples per epoch: a sampler may select a subset of the dataset
+    # (computed before the epoch starts, the pruning sampler selects the samples of the next epoch)
+    if hasattr(train_loader.sampler, '__len__'):
+        epoch_size = len(train_loader.sampler)
+    else:
+        epoch_size = len(train_loader.dataset)
 
     for batch_idx, sample in enumerate(train_loader):
         # Sent data and label to specified device
-        data, label = sample['image'].to(device), sample['label'].to(device)
+        # non_blocking overlaps the copy with computation when batches are in pinned memory
+        data = sample['image'].to(device, non_blocking=True)
+        label = sample['label'].to(device, non_blocking=True)
+        data = to_float_image(data) # uint8 images are converted per batch
         optimizer.zero_grad() # Set all gradients to 0
         y_pred = model(data)
         loss = loss_function(y_pred, label)
         # Saves batch loss in a list
         if save:
             losses.append(loss)
+        # Per-sample losses, without building a graph
+        if loss_tracker is not None:
+            if 'index' not in sample:
+                raise ValueError("loss_tracker requires a dataset returning the position of each sample as 'index'")
+            loss_tracker.update(sample['index'], F.cross_entropy(y_pred.detach(), label, reduction='none'))
 
         loss.backward() # Backpropagation
         optimizer.step()
@@ -312,22 +329,23 @@ def train_model(
         # Count correct predictions
         preds = y_pred.argmax(dim=1, keepdim=True)
         corrects += preds.eq(label.view_as(preds)).sum().item()
+        n_samples += len(label)
 
         # Print loss every x batches
         if verbose >= 1:
             if batch_idx % 10 == 0:
                 print("Train Epoch {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}".format(
-                    epoch, batch_idx * len(data), len(train_loader.dataset),
-                    100 * batch_idx * len(data) / len(train_loader.dataset), loss.item()
+                    epoch, n_samples, epoch_size, 100 * n_samples / epoch_size, loss.item()
                 ))
     # Compute epoch average train loss and train accuracy
     avg_loss = sum(losses) / len(losses)
-    overall_accuracy = 100 * corrects / len(train_loader.dataset)
+    # Samples seen this epoch: the whole dataset, unless a sampler selects a subset
+    overall_accuracy = 100 * corrects / n_samples
 
     # Print epoch average loss and accuracy
     if verbose == 2:
         print("\nTrain set : Average loss {:.4f}, Accuracy : {}/{} ({:.0f}%)".format(
-            avg_loss, corrects, len(train_loader.dataset), overall_accuracy
+            avg_loss, corrects, n_samples, overall_accuracy
         ))
 
     # Return epoch average loss and accuracy
@@ -392,7 +410,9 @@ def validate_model(
     with torch.no_grad():
         for sample in valid_loader:
             # Sent data and label to specified device
-            data, label = sample['image'].to(device), sample['label'].to(device)
+            data = sample['image'].to(device, non_blocking=True)
+            label = sample['label'].to(device, non_blocking=True)
+            data = to_float_image(data)
 
             # Predict and compute loss
             y_pred = model(data)
@@ -475,7 +495,9 @@ def test_model(
 
     with torch.no_grad():
         for sample in test_loader:
-            test_data, test_label = sample['image'].to(device), sample['label'].to(device)
+            test_data = sample['image'].to(device, non_blocking=True)
+            test_label = sample['label'].to(device, non_blocking=True)
+            test_data = to_float_image(test_data)
 
             logits = get_models_predictions(models, test_data)
             y_pred_test = torch.argmax(logits, dim=1) # prediction
@@ -498,6 +520,16 @@ def test_model(
     return metrics
 
 
+def to_float_image(data: torch.Tensor) -> torch.Tensor:
+    """
+    Convert a batch of uint8 images to float images in [0, 1], as ToTensor would.
+    Float images are returned unchanged.
+    """
+    if data.dtype == torch.uint8:
+        return data.float().div_(255)
+    return data
+
+
 def _ensure_model_list(models):
     """ 
     Check if a list of models is provided or not.
@@ -0,0 +1,201 @@
+from typing import Callable, Union
+
+import os
+import json
+import time
+import hashlib
+import inspect
+
+import torch
+
+
+class Stage:
+    """
+    Stage of a Pipeline: a function, the stages whose outputs it takes as inputs, its configuration,
+    and the code it calls.
+    """
+    def __init__(self, name: str, fn: Callable, inputs: list = (), config: dict = None, code: list = ()):
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs) # Names of the upstream stages
+        self.config = dict(config or {})
+        self.code = list(code) # Functions, classes or modules called by fn
+
+    def code_fingerprint(self) -> str:
+        """
+        Source code of the stage function and of its declared code dependencies,
+        so that editing them invalidates the stage outputs.
+        """
+        return '\n'.join(_source(obj) for obj in (self.fn, *self.code))
+
+
+def _source(obj) -> str:
+    """
+    Source code of a function, class or module, or its name if the source is not available.
+    """
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        return getattr(obj, '__qualname__', getattr(obj, '__name__', repr(obj)))
+
+
+class Pipeline:
+    """
+    Pipeline of stages (e.g. preprocess -> train -> evaluate) forming a DAG, with a content-addressed store
+    of their outputs.
+    The key of a stage output is a hash of the stage configuration, its code and the keys of its inputs:
+    a stage is run again only if one of them changed, otherwise its stored output is reused.
+    Upstream stages are not even loaded when a downstream output is up to date.
+    Only the source of the stage function itself is hashed: the functions it calls (such as models.train_model)
+    must be declared with the code argument of add_stage, otherwise editing them does not invalidate the output.
+
+    Stage functions are called with the outputs of their inputs and their configuration as keyword arguments.
+    Outputs are saved with torch.save: tensors, state dicts, metrics dictionnaries, etc.
+
+    Example
+    -------
+    >>> pipeline = Pipeline('pipeline_store')
+    >>> pipeline.add_stage('preprocess', preprocess, config={'size': 256, 'compact': True})
+    >>> pipeline.add_stage('train', train, inputs=['preprocess'], config={'lr': 1e-4, 'n_epochs': 50},
+    >>>                    code=[models.train_model])
+    >>> pipeline.add_stage('evaluate', evaluate, inputs=['preprocess', 'train'])
+    >>> # def train(preprocess, lr, n_epochs): ... return model.state_dict()
+    >>> outputs = pipeline.run('evaluate')
+    >>> # After a change of the evaluate function only
+    >>> outputs = pipeline.run('evaluate')
+    >>> pipeline.status
+    {'preprocess': 'cached', 'train': 'cached', 'evaluate': 'run'}
+    """
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.stages = {}
+        self.status = {} # 'cached' or 'run', for the stages touched by the last run
+
+    def add_stage(
+            self,
+            name: str,
+            fn: Callable,
+            inputs: list = (),
+            config: dict = None,
+            code: list = ()
+        ) -> Stage:
+        """
+        Add a stage. Its inputs must already be stages of the pipeline, so the pipeline has no cycle.
+
+        Parameters
+        ----------
+        name : str
+            Stage name, also the keyword of its output in downstream stages
+        fn : Callable
+            Stage function
+        inputs : list, default ()
+            Names of the stages whose outputs are given to fn
+        config : dict, default None
+            Keyword arguments of fn. Values must be JSON serializable or have a stable repr.
+        code : list, default ()
+            Functions, classes or modules called by fn, whose source code is hashed with fn
+
+        Returns
+        -------
+        Stage
+        """
+        missing = [input_name for input_name in inputs if input_name not in self.stages]
+        if missing:
+            raise ValueError(f"Stage {name} depends on unknown stages {missing}")
+        if name in self.stages:
+            raise ValueError(f"Stage {name} already exists")
+
+        self.stages[name] = Stage(name, fn, inputs, config, code)
+
+        return self.stages[name]
+
+    def key(self, name: str) -> str:
+        """
+        Return the key of a stage output: hash of its configuration, code and input keys.
+        """
+        stage = self.stages[name]
+        fingerprint = json.dumps({
+            'name': name,
+            'config': stage.config,
+            'code': stage.code_fingerprint(),
+            'inputs': {input_name: self.key(input_name) for input_name in stage.inputs}
+        }, sort_keys=True, default=repr)
+
+        return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+
+    def output_path(self, name: str) -> str:
+        return os.path.join(self.store_dir, name, f"{self.key(name)}.pt")
+
+    def is_up_to_date(self, name: str) -> bool:
+        return os.path.exists(self.output_path(name))
+
+    def run(self, targets: Union[str, list] = None, force: list = ()) -> dict:
+        """
+        Compute the outputs of the target stages, running only the stages which are not up to date.
+
+        Parameters
+        ----------
+        targets : str or list, default None
+            Target stages. None for every stage without downstream stage.
+        force : list, default ()
+            Stages to run even if they are up to date
+
+        Returns
+        -------
+        dict : Output of each target stage
+        """
+        if targets is None:
+            used = {input_name for stage in self.stages.values() for input_name in stage.inputs}
+            targets = [name for name in self.stages if name not in used]
+        elif isinstance(targets, str):
+            targets = [targets]
+
+        self.status = {}
+        outputs = {}
+
+        return {name: self._output(name, outputs, set(force)) for name in targets}
+
+    def _output(self, name: str, outputs: dict, force: set):
+        """
+        Return the output of a stage: from this run, from the store, or by running the stage.
+        """
+        if name in outputs:
+            return outputs[name]
+
+        path = self.output_path(name)
+        if name not in force and os.path.exists(path):
+            # Outputs of the store are written by this pipeline only
+            outputs[name] = torch.load(path, weights_only=False)
+            self.status[name] = 'cached'
+            return outputs[name]
+
+        stage = self.stages[name]
+        inputs = {input_name: self._output(input_name, outputs, force) for input_name in stage.inputs}
+
+        start = time.perf_counter()
+        outputs[name] = stage.fn(**inputs, **stage.config)
+        self._save(name, outputs[name], time.perf_counter() - start)
+        self.status[name] = 'run'
+
+        return outputs[name]
+
+    def _save(self, name: str, output, wall_time: float) -> None:
+        """
+        Write a stage output and its description in the store.
+        The output is written under a temporary name then renamed, so a stage interrupted is not up to date.
+        """
+        path = self.output_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+            stage = self.stages[name]
+            json.dump({
+                'stage': name,
+                'config': stage.config,
+                'inputs': {input_name: self.key(input_name) for input_name in stage.inputs},
+                'wall_time': wall_time
+            }, f, indent=2, default=repr)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save(output, tmp_path)
+        os.replace(tmp_path, path)
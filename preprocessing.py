@@ -1,17 +1,44 @@
-from typing import Tuple
+from typing import Callable, Iterator, Tuple, Union
+
+import io
+import os
+import glob
+import json
+import math
+import random
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 import datasets
 from datasets import load_dataset
 
 import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import torch
-from torch.utils.data import Dataset, DataLoader
+import torch.nn.functional as F
+from torch.utils.data import Dataset, IterableDataset, DataLoader, Sampler, get_worker_info, default_collate
+
+from PIL import Image, ImageOps, ExifTags
 
 from torchvision.transforms import transforms
-from torchvision.transforms.functional import adjust_contrast
+from torchvision.transforms.functional import adjust_contrast, center_crop, pil_to_tensor, to_pil_image
 
 from sklearn.preprocessing import LabelEncoder
 
+from cache import (
+    cache_key, augmentation_key, load_cached_split, save_cached_split, append_cached_split,
+    load_cached_classes, set_label_classes, extend_label_encoder, is_memory_mapped,
+    compression_key, save_compressed_images, load_compressed_images
+)
+
+
+# Maximum number of images preprocessed by a process before being copied into the output tensor
+PREPROCESS_CHUNK_SIZE = 256
+
 
 class CustomDataset(Dataset):
     """
@@ -22,34 +49,926 @@ class CustomDataset(Dataset):
             tensors: torch.Tensor,
             minority_classes: list,
             train: bool,
-            transform: transforms
+            transform: transforms,
+            crop_size: int = 224,
+            variants: torch.Tensor = None
         ):
         self.tensors = tensors # Data and labels
         self.minority_classes = minority_classes
         self.train = train # train set or not
         self.transform = transform # transformations
+        self.crop_size = crop_size # None to leave the crop to a BatchAugmentation
+
+        labels = self.tensors[1]
+        # True for images to transform: minority classes on train set, every image otherwise
+        if self.train:
+            self.augment_mask = torch.isin(labels, torch.as_tensor(minority_classes, dtype=labels.dtype))
+        else:
+            self.augment_mask = torch.ones(len(labels), dtype=torch.bool)
+        # Dataset indices of each class
+        self.class_indices = get_class_indices(labels)
+
+        # Precomputed augmentations of the images to transform, see precompute_augmentations
+        self.variants = variants
+        if variants is not None:
+            self.n_variants = variants.size(0) // max(int(self.augment_mask.sum()), 1)
+            # Position of each image among the images to transform
+            self.variant_rows = torch.cumsum(self.augment_mask, dim=0) - 1
+
+    def share_memory(self):
+        """
+        Move the dataset tensors to shared memory, so that all DataLoader workers read the same physical pages.
+        Memory-mapped cache tensors are already shared through the page cache and are left in place.
+        Only needed for workers started with spawn or forkserver: forked workers already share the pages
+        copy-on-write, while the copy doubles the memory of the split for a while and needs enough /dev/shm space.
+        """
+        variants = (self.variants, self.variant_rows) if self.variants is not None else ()
+        for tensor in (*self.tensors, self.augment_mask, *self.class_indices.values(), *variants):
+            if isinstance(tensor, torch.Tensor) and not tensor.is_shared() and not is_memory_mapped(tensor):
+                tensor.share_memory_()
+            # Image stores holding their own tensors
+            elif hasattr(tensor, 'share_memory'):
+                tensor.share_memory()
+
+        return self
 
     def __len__(self):
-        return self.tensors[0].size(0)
+        return self.tensors[1].size(0)
     
     def __getitem__(self, idx):
         # Retrieve image
         data = self.tensors[0][idx]
         # Retrieve label
         label = self.tensors[1][idx]
+        augment = bool(self.augment_mask[idx])
+        # Pick one of the precomputed augmentations instead of transforming the image
+        if augment and self.variants is not None:
+            variant = int(torch.randint(self.n_variants, ()))
+            data = self.variants[int(self.variant_rows[idx]) * self.n_variants + variant]
+            augment = False
         # Transform image
-        if self.transform:
-            # If train set, apply data augmentation only on minority classes
-            if self.train and label in self.minority_classes:
-                data = self.transform(data)
-            elif not self.train:
-                data = self.transform(data)
-        
-        # Ensure that all images are 224x224 pixels
-        if data.size(2) != 224:
-            data = transforms.CenterCrop(size=(224, 224))(data)
+        data = transform_sample(data, self.transform, augment, self.crop_size)
+
+        # Dataset position, to record per-sample losses (see LossTracker)
+        return {"image": data, "label": label, "index": idx}
+
+
+class ClassBalancedSampler(Sampler):
+    """
+    Sampler drawing a fixed budget of samples per epoch, split between classes.
+    Classes larger than their share are undersampled (without replacement),
+    smaller classes are repeated as evenly as possible, so every class gets the same exposure.
+    An epoch can then be much shorter than the dataset, which is dominated by the majority class.
+
+    Example
+    -------
+    >>> train_dataset = create_torch_dataset(...)
+    >>> sampler = ClassBalancedSampler(train_dataset.class_indices, num_samples=3500)
+    >>> train_dataloader = create_dataloader(dataset=train_dataset, batch_size=64, shuffle=False, sampler=sampler)
+    """
+    def __init__(
+            self,
+            class_indices: dict,
+            num_samples: int = None,
+            class_weights: dict = None,
+            seed: int = None
+        ):
+        """
+        Parameters
+        ----------
+        class_indices : dict
+            Dataset indices of each class, see get_class_indices
+        num_samples : int, default None
+            Number of samples per epoch. Defaults to the number of classes times the median class size.
+        class_weights : dict, default None
+            Relative share of each class. Defaults to the same share for every class.
+        seed : int, default None
+            Random seed
+        """
+        self.class_indices = class_indices
+        sizes = [len(indices) for indices in class_indices.values()]
+        self.num_samples = num_samples or len(sizes) * int(np.median(sizes))
+        self.class_weights = class_weights or {c: 1.0 for c in class_indices}
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed if seed is not None else int(torch.empty((), dtype=torch.int64).random_()))
+
+    def class_counts(self) -> dict:
+        """
+        Number of samples of each class per epoch. Rounding leftovers go to the largest shares.
+        """
+        total = sum(self.class_weights[c] for c in self.class_indices)
+        shares = {c: self.num_samples * self.class_weights[c] / total for c in self.class_indices}
+        counts = {c: int(share) for c, share in shares.items()}
+        leftovers = sorted(shares, key=lambda c: shares[c] - counts[c], reverse=True)
+        for c in leftovers[:self.num_samples - sum(counts.values())]:
+            counts[c] += 1
+
+        return counts
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        samples = []
+        for c, count in self.class_counts().items():
+            indices = self.class_indices[c]
+            # Whole permutations of the class first, then a random subset
+            repeats, remainder = divmod(count, len(indices))
+            for _ in range(repeats):
+                samples.append(indices[torch.randperm(len(indices), generator=self.generator)])
+            samples.append(indices[torch.randperm(len(indices), generator=self.generator)[:remainder]])
+
+        samples = torch.cat(samples)
+        samples = samples[torch.randperm(len(samples), generator=self.generator)]
+
+        return iter(samples.tolist())
+
+
+class LossTracker:
+    """
+    Loss of every training sample, indexed by dataset position (4 bytes per sample), filled by train_model.
+    Losses are averaged over epochs with an exponential moving average, so an easy sample is a sample
+    with a low loss over several epochs. Samples never seen have a NaN loss.
+    """
+    def __init__(self, num_samples: int, momentum: float = 0.5):
+        self.losses = torch.full((num_samples,), float('nan'))
+        self.momentum = momentum # Weight of the previous losses
+
+    def __len__(self):
+        return self.losses.size(0)
+
+    def update(self, indices: torch.Tensor, losses: torch.Tensor) -> None:
+        """
+        Record the losses of a batch of samples.
+        """
+        indices, losses = indices.cpu(), losses.detach().float().cpu()
+        previous = self.losses[indices]
+        self.losses[indices] = torch.where(
+            torch.isnan(previous), losses, self.momentum * previous + (1 - self.momentum) * losses
+        )
+
+
+class LossPruningSampler(Sampler):
+    """
+    Sampler skipping the easiest training samples, according to the losses recorded by train_model.
+    Each epoch keeps the keep_ratio fraction of samples with the highest loss, plus the protected samples
+    (e.g. minority classes) and the samples never seen. Every refresh_every epochs, all samples are used,
+    which also refreshes the losses of the skipped samples.
+
+    Example
+    -------
+    >>> train_dataloader = generate_dataloader(..., sampler='pruning', prune_keep_ratio=0.5)
+    >>> for epoch in range(1, n_epochs + 1):
+    >>>     train_model(..., train_loader=train_dataloader, loss_tracker=train_dataloader.sampler.loss_tracker)
+    """
+    def __init__(
+            self,
+            loss_tracker: LossTracker,
+            keep_ratio: float = 0.5,
+            refresh_every: int = 5,
+            protected_indices: torch.Tensor = None,
+            seed: int = None
+        ):
+        """
+        Parameters
+        ----------
+        loss_tracker : LossTracker
+            Per-sample losses, updated by train_model
+        keep_ratio : float, default 0.5
+            Fraction of the unprotected samples used between two refreshes
+        refresh_every : int, default 5
+            Number of epochs between two epochs on all samples. None to only use all samples on the first epoch.
+        protected_indices : torch.Tensor, default None
+            Dataset indices never skipped, such as the indices of the minority classes
+        seed : int, default None
+            Random seed of the shuffling
+        """
+        self.loss_tracker = loss_tracker
+        self.keep_ratio = keep_ratio
+        self.refresh_every = refresh_every
+        self.protected = torch.zeros(len(loss_tracker), dtype=torch.bool)
+        if protected_indices is not None:
+            self.protected[protected_indices] = True
+        self.epoch = 0
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed if seed is not None else int(torch.empty((), dtype=torch.int64).random_()))
+
+    def select(self) -> torch.Tensor:
+        """
+        Dataset indices used by the next epoch.
+        """
+        losses = self.loss_tracker.losses
+        if self.epoch == 0 or (self.refresh_every and self.epoch % self.refresh_every == 0):
+            return torch.arange(len(losses))
+
+        prunable = ~self.protected & ~torch.isnan(losses)
+        candidates = torch.nonzero(prunable).flatten()
+        n_keep = math.ceil(self.keep_ratio * len(candidates))
+        hardest = candidates[torch.topk(losses[candidates], n_keep).indices]
+
+        keep = ~prunable
+        keep[hardest] = True
+
+        return torch.nonzero(keep).flatten()
+
+    def __len__(self):
+        return len(self.select())
+
+    def __iter__(self):
+        indices = self.select()
+        self.epoch += 1
+
+        return iter(indices[torch.randperm(len(indices), generator=self.generator)].tolist())
+
+
+class CompressedImages:
+    """
+    Preprocessed images stored encoded (JPEG, WebP or PNG) in one contiguous byte buffer with an offset index.
+    Can replace the images tensor of a CustomDataset: images are decoded on access, in the DataLoader workers.
+    A 3x256x256 image takes about 20 to 40 kB as high-quality JPEG, instead of 786 kB as float32.
+    """
+    def __init__(self, buffer: torch.Tensor, offsets: torch.Tensor, compact: bool = False):
+        self.buffer = buffer # uint8, all encoded images
+        self.offsets = offsets # int64, image idx is buffer[offsets[idx]:offsets[idx + 1]]
+        self.compact = compact # Decode to uint8 instead of float
+
+    @classmethod
+    def from_tensor(
+            cls,
+            images: torch.Tensor,
+            image_format: str = 'jpeg',
+            quality: int = 95,
+            compact: bool = False,
+            num_proc: int = None
+        ):
+        """
+        Encode a tensor of preprocessed images.
+        With num_proc > 1, contiguous chunks of images are encoded by a pool of processes.
+
+        Parameters
+        ----------
+        images : torch.Tensor
+            Preprocessed images (N, C, H, W), float in [0, 1] or uint8
+        image_format : {'jpeg', 'webp', 'png'}, default 'jpeg'
+            Image encoding. PNG is lossless but larger.
+        quality : int, default 95
+            JPEG and WebP quality
+        compact : bool, default False
+            Set to True to decode images to uint8 pixels
+        num_proc : int, default None
+            Number of encoding processes. None or 1 to encode in the current process.
+
+        Returns
+        -------
+        CompressedImages
+        """
+        n_images = len(images)
+        if num_proc is None or num_proc <= 1 or n_images < 2:
+            encoded = _encode_chunk(images, image_format, quality, 0, n_images)
+        else:
+            encoded = [None] * n_images
+            n_chunks = min(n_images, max(num_proc * 4, -(-n_images // PREPROCESS_CHUNK_SIZE)))
+            bounds = np.linspace(0, n_images, n_chunks + 1, dtype=int)
+            # Images are sent once per process, not once per chunk
+            with ProcessPoolExecutor(
+                max_workers=num_proc,
+                initializer=_init_encode_worker,
+                initargs=(images, image_format, quality)
+            ) as executor:
+                # At most 2 chunks per process in flight, as in preprocess_splits
+                pending = {}
+                for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+                    pending[executor.submit(_encode_worker_chunk, start, stop)] = (start, stop)
+                    if len(pending) < 2 * num_proc:
+                        continue
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        start, stop = pending.pop(future)
+                        encoded[start:stop] = future.result()
+                for future in list(pending):
+                    start, stop = pending.pop(future)
+                    encoded[start:stop] = future.result()
+
+        offsets = torch.zeros(len(encoded) + 1, dtype=torch.int64)
+        offsets[1:] = torch.cumsum(torch.tensor([len(data) for data in encoded], dtype=torch.int64), dim=0)
+
+        buffer = torch.empty(int(offsets[-1]), dtype=torch.uint8)
+        for idx, data in enumerate(encoded):
+            buffer[offsets[idx]:offsets[idx + 1]] = torch.frombuffer(bytearray(data), dtype=torch.uint8)
+
+        return cls(buffer, offsets, compact)
+
+    @property
+    def nbytes(self):
+        return self.buffer.nelement() + self.offsets.nelement() * self.offsets.element_size()
+
+    def __len__(self):
+        return self.offsets.size(0) - 1
+
+    def __getitem__(self, idx):
+        start, stop = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return decode_image_tensor(self.buffer[start:stop].numpy(), self.compact)
+
+    def share_memory(self):
+        # A buffer read from the cache is memory-mapped, already shared through the page cache
+        if not is_memory_mapped(self.buffer):
+            self.buffer.share_memory_()
+        self.offsets.share_memory_()
+
+        return self
+
+
+def _encode_chunk(images, image_format, quality, start, stop) -> list:
+    """
+    Encode images from start to stop, see encode_image.
+    """
+    return [encode_image(images[idx], image_format, quality) for idx in range(start, stop)]
+
+
+def _init_encode_worker(images, image_format, quality):
+    """
+    Store the images to encode and the encoding parameters in the encoding process.
+    """
+    torch.set_num_threads(1)
+    _worker_state['images'] = images
+    _worker_state['encoding'] = (image_format, quality)
+
+
+def _encode_worker_chunk(start, stop):
+    """
+    Encode a chunk of images in an encoding process.
+    """
+    return _encode_chunk(_worker_state['images'], *_worker_state['encoding'], start, stop)
+
+
+class LazyImages:
+    """
+    Images of a HuggingFace dataset kept encoded, decoded and preprocessed on access.
+    Can replace the images tensor of a CustomDataset.
+    Recently decoded images are kept in a LRU cache limited to max_cache_bytes,
+    so they are not decoded again at the next epoch when the cache is large enough.
+    Each DataLoader worker holds its own cache, which only lives as long as the worker: use persistent workers.
+    Shuffled batches are spread over workers at random, so an image is found in the cache of the worker
+    loading it about once out of num_workers times, unless each cache holds the whole split.
+    """
+    def __init__(
+            self,
+            dataset: datasets.Dataset,
+            preprocess_transform: transforms,
+            compact: bool = False,
+            max_cache_bytes: int = 2**30,
+            draft: bool = False
+        ):
+        self.preprocess_transform = preprocess_transform
+        if self.preprocess_transform is None:
+            self.preprocess_transform = transforms.ToTensor()
+        # Encoded bytes are read from the Arrow buffers, images are only decoded on access
+        draft_size = get_draft_size(self.preprocess_transform) if draft else None
+        self.images = get_image_reader(dataset, draft_size)
+        if compact:
+            self.preprocess_transform = transforms.Compose([self.preprocess_transform, ToUint8()])
+        self.max_cache_bytes = max_cache_bytes
+
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, idx):
+        idx = int(idx)
+        if idx in self.cache:
+            # Most recently used at the end
+            self.cache.move_to_end(idx)
+            return self.cache[idx]
+
+        data = self.preprocess_transform(self.images[idx])
+
+        nbytes = data.nelement() * data.element_size()
+        if nbytes <= self.max_cache_bytes:
+            self.cache[idx] = data
+            self.cache_bytes += nbytes
+            # Evict least recently used images
+            while self.cache_bytes > self.max_cache_bytes:
+                _, evicted = self.cache.popitem(last=False)
+                self.cache_bytes -= evicted.nelement() * evicted.element_size()
+
+        return data
+
+
+class StreamingDataset(IterableDataset):
+    """
+    Streaming dataset reading local Arrow or Parquet shards of a HuggingFace dataset.
+    Images are decoded, preprocessed and augmented on the fly, so memory use does not depend on the dataset size.
+    Shards are split between DataLoader workers and samples are shuffled through a bounded buffer.
+    """
+    def __init__(
+            self,
+            files: list,
+            preprocess_transform: transforms,
+            label_encoder: LabelEncoder,
+            minority_classes: list,
+            train: bool,
+            transform: transforms,
+            shuffle: bool = True,
+            shuffle_buffer: int = 1000,
+            compact: bool = False,
+            crop_size: int = 224,
+            draft: bool = False
+        ):
+        # Same default as import_and_preprocess_image
+        if preprocess_transform is None:
+            preprocess_transform = transforms.ToTensor()
+
+        self.files = sorted(files) # Same shard order in every worker
+        self.preprocess_transform = preprocess_transform
+        self.draft_size = get_draft_size(preprocess_transform) if draft else None
+        self.minority_classes = minority_classes
+        self.train = train
+        self.transform = transform
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.crop_size = crop_size
+
+        if compact:
+            self.preprocess_transform = transforms.Compose([preprocess_transform, ToUint8()])
+
+        # Fit the label encoder on the label column only, images are not read
+        if not hasattr(label_encoder, 'classes_'):
+            label_encoder.fit(np.unique(np.concatenate([
+                pc.unique(batch.column('dx')).to_numpy(zero_copy_only=False)
+                for file in self.files for batch in _iter_record_batches(file, columns=['dx'])
+            ])))
+        self.label_mapping = {label: idx for idx, label in enumerate(label_encoder.classes_)}
+        self.minority_set = set(int(c) for c in minority_classes)
+
+        # Position of the first row of each shard in the dataset, to index samples whatever the shard order
+        self.file_offsets, self.num_rows = {}, 0
+        for file in self.files:
+            self.file_offsets[file] = self.num_rows
+            self.num_rows += _count_rows(file)
+
+    def __len__(self):
+        return self.num_rows
+
+    def __iter__(self):
+        files, row_step, row_offset, rng = assign_worker_shards(self.files, self.shuffle)
+
+        samples = self._iter_samples(files, row_step, row_offset)
+        if self.shuffle:
+            samples = shuffle_buffer(samples, self.shuffle_buffer, rng)
+
+        for sample in samples:
+            yield sample
+
+    def _iter_samples(self, files, row_step, row_offset):
+        row = 0
+        for file in files:
+            index = self.file_offsets[file]
+            for batch in _iter_record_batches(file, columns=['image', 'dx']):
+                images = batch.column('image')
+                labels = batch.column('dx')
+                for i in range(batch.num_rows):
+                    if row % row_step == row_offset:
+                        data = self.preprocess_transform(decode_image(images[i].as_py(), draft_size=self.draft_size))
+                        label = self.label_mapping[labels[i].as_py()]
+                        augment = not self.train or label in self.minority_set
+                        data = transform_sample(data, self.transform, augment, self.crop_size)
+                        yield {"image": data, "label": torch.tensor(label), "index": index}
+                    row += 1
+                    index += 1
+
+
+def transform_sample(
+        data: torch.Tensor,
+        transform: transforms,
+        augment: bool,
+        crop_size: int = 224
+    ) -> torch.Tensor:
+    """
+    Apply the part set transformations to one image, then center crop it to crop_size x crop_size pixels.
+    On the training set, transformations (data augmentation) are only applied to minority classes,
+    that is when augment is True.
+
+    Parameters
+    ----------
+    data : torch.Tensor
+        Image
+    transform : transforms
+        Transformations to apply
+    augment : bool
+        True to apply the transformations
+    crop_size : int, default 224
+        Output size. None to not crop the image.
+
+    Returns
+    -------
+    torch.Tensor
+    """
+    if transform and augment:
+        data = transform(data)
+
+    # Ensure that all images are crop_size x crop_size pixels
+    if crop_size is not None and data.size(2) != crop_size:
+        data = center_crop(data, [crop_size, crop_size])
+
+    return data
+
+
+def precompute_augmentations(
+        images: torch.Tensor,
+        augment_mask: torch.Tensor,
+        transform: transforms,
+        n_variants: int,
+        seed: int = 0
+    ) -> torch.Tensor:
+    """
+    Apply the transformations n_variants times to every image to transform.
+    Variants of the image idx only depend on seed and idx, so they are the same from one run to another.
+    The global random states are left unchanged.
+
+    Parameters
+    ----------
+    images : torch.Tensor
+        Preprocessed images
+    augment_mask : torch.Tensor
+        True for images to transform, see CustomDataset
+    transform : transforms
+        Random transformations (data augmentation)
+    n_variants : int
+        Number of variants per image
+    seed : int, default 0
+        Random seed
+
+    Returns
+    -------
+    torch.Tensor : Variants, n_variants consecutive rows per image to transform
+    """
+    indices = torch.nonzero(augment_mask).flatten().tolist()
+    variants = None
+
+    python_state = random.getstate()
+    with torch.random.fork_rng(devices=[]):
+        for row, idx in enumerate(indices):
+            # torchvision draws from both the torch and the python random generators
+            sample_seed = int(np.random.SeedSequence([seed, idx]).generate_state(1)[0])
+            torch.manual_seed(sample_seed)
+            random.seed(sample_seed)
+            for variant in range(n_variants):
+                data = transform(images[idx])
+                if variants is None:
+                    variants = torch.empty((len(indices) * n_variants, *data.shape), dtype=data.dtype)
+                variants[row * n_variants + variant] = data
+    random.setstate(python_state)
+
+    if variants is None:
+        variants = torch.empty((0, *images[0].shape), dtype=images[0].dtype)
+
+    return variants
+
+
+def get_class_indices(labels: torch.Tensor) -> dict:
+    """
+    Return the dataset indices of each class, as a dictionnary of tensors.
+
+    Parameters
+    ----------
+    labels : torch.Tensor
+        Encoded labels
+
+    Returns
+    -------
+    dict
+
+    Example
+    -------
+    >>> get_class_indices(torch.tensor([1, 0, 1, 2]))
+    {0: tensor([1]), 1: tensor([0, 2]), 2: tensor([3])}
+    """
+    # One stable sort instead of one scan of the labels per class
+    order = torch.argsort(labels, stable=True)
+    classes, counts = torch.unique_consecutive(labels[order], return_counts=True)
+
+    return dict(zip(classes.tolist(), torch.split(order, counts.tolist())))
+
+
+def assign_worker_shards(files: list, shuffle: bool) -> tuple:
+    """
+    Return the shards read by the current DataLoader worker, with a random generator seeded for this worker.
+    With enough shards, each worker reads its own shards. Otherwise every worker reads all shards
+    and keeps one row out of num_workers, from row_offset with a step of row_step.
+
+    Parameters
+    ----------
+    files : list
+        Shards, in the same order in every worker
+    shuffle : bool
+        Set to True to shuffle the shards order
+
+    Returns
+    -------
+    (list, int, int, np.random.Generator) : files, row_step, row_offset, rng
+    """
+    worker_info = get_worker_info()
+    if worker_info is None:
+        worker_id, num_workers = 0, 1
+        # Different seed at every epoch
+        seed = int(torch.empty((), dtype=torch.int64).random_().item())
+    else:
+        # DataLoader draws a new seed for each worker at every epoch
+        worker_id, num_workers, seed = worker_info.id, worker_info.num_workers, worker_info.seed
+
+    rng = np.random.default_rng(seed)
+
+    if len(files) >= num_workers:
+        files, row_step, row_offset = files[worker_id::num_workers], 1, 0
+    else:
+        files, row_step, row_offset = files, num_workers, worker_id
+
+    # Rows are counted across shards, so the shard order is only shuffled when shards are not shared
+    if shuffle and row_step == 1:
+        files = [files[i] for i in rng.permutation(len(files))]
+
+    return files, row_step, row_offset, rng
+
+
+def shuffle_buffer(samples: Iterator, buffer_size: int, rng: np.random.Generator) -> Iterator:
+    """
+    Shuffle an iterator through a buffer of buffer_size samples.
+    Each incoming sample replaces a random sample of the full buffer, which is yielded.
+
+    Parameters
+    ----------
+    samples : Iterator
+        Samples to shuffle
+    buffer_size : int
+        Number of samples held in memory
+    rng : np.random.Generator
+        Random generator
+
+    Returns
+    -------
+    Iterator
+    """
+    buffer = []
+    for sample in samples:
+        if len(buffer) < buffer_size:
+            buffer.append(sample)
+            continue
+        idx = rng.integers(buffer_size)
+        yield buffer[idx]
+        buffer[idx] = sample
+
+    # Flush the buffer in random order
+    for idx in rng.permutation(len(buffer)):
+        yield buffer[idx]
+
+
+def decode_image(image: dict, mode: str = None, draft_size: tuple = None) -> Image.Image:
+    """
+    Decode an image stored by a HuggingFace Image feature ({'bytes': ..., 'path': ...}).
+    """
+    if image['bytes'] is not None:
+        return decode_image_bytes(image['bytes'], mode, draft_size)
+    return decode_image_bytes(image['path'], mode, draft_size)
+
+
+def decode_image_bytes(source, mode: str = None, draft_size: tuple = None) -> Image.Image:
+    """
+    Decode encoded image bytes (any bytes-like object) or an image file path,
+    as the HuggingFace Image feature does.
+
+    If draft_size (width, height) is given, JPEG images are decoded at the smallest DCT scale
+    (1/2, 1/4 or 1/8) that keeps both dimensions at least as large as draft_size.
+    """
+    if isinstance(source, str):
+        pil_image = Image.open(source)
+    else:
+        pil_image = Image.open(io.BytesIO(source))
+
+    if draft_size is not None and pil_image.format == 'JPEG':
+        # Draft size applies before the EXIF rotation
+        if pil_image.getexif().get(ExifTags.Base.Orientation, 1) >= 5:
+            draft_size = draft_size[::-1]
+        pil_image.draft(pil_image.mode, draft_size)
+    pil_image.load()
+
+    if pil_image.getexif().get(ExifTags.Base.Orientation) is not None:
+        pil_image = ImageOps.exif_transpose(pil_image)
+    if mode and mode != pil_image.mode:
+        pil_image = pil_image.convert(mode)
+
+    return pil_image
+
+
+def encode_image(image: torch.Tensor, image_format: str = 'png', quality: int = 95) -> bytes:
+    """
+    Encode a preprocessed image tensor (C, H, W), float in [0, 1] or uint8, as PNG, JPEG or WebP bytes.
+    PNG is lossless, quality is used by JPEG and WebP.
+    """
+    pil_image = to_pil_image(ToUint8()(image))
+    buffer = io.BytesIO()
+    if image_format.lower() == 'png':
+        pil_image.save(buffer, format='PNG')
+    else:
+        pil_image.save(buffer, format=image_format.upper(), quality=quality)
+
+    return buffer.getvalue()
+
+
+def decode_image_tensor(buffer, compact: bool = False) -> torch.Tensor:
+    """
+    Decode bytes written by encode_image into an image tensor (C, H, W),
+    uint8 if compact, otherwise float in [0, 1] as ToTensor returns.
+    """
+    image = pil_to_tensor(Image.open(io.BytesIO(buffer)))
+    if compact:
+        return image
+
+    return image.float().div_(255)
+
+
+class ArrowImageReader:
+    """
+    Read the encoded images of a HuggingFace dataset directly from the Arrow buffers of its image column.
+    Bytes are accessed as numpy views of the Arrow buffers, without building a Python dict
+    and a PIL image per row as dataset[idx]['image'] does.
+    Indexing returns the decoded PIL image, encoded(idx) returns the encoded bytes.
+    """
+    def __init__(self, dataset: datasets.Dataset, column: str = 'image', draft_size: tuple = None):
+        self.dataset = dataset
+        self.column = column
+        self.mode = dataset.features[column].mode
+        self.draft_size = draft_size # JPEG reduced-scale decoding, see decode_image_bytes
+        self._read_buffers()
+
+    def _read_buffers(self):
+        # Zero-copy slice of the underlying table (a copy only if the dataset has an indices mapping)
+        column = self.dataset.with_format('arrow')[:].column(self.column)
+        bytes_field = column.type.get_field_index('bytes')
+        path_field = column.type.get_field_index('path')
+
+        self._data, self._offsets, self._nulls, self._paths = [], [], [], []
+        for chunk in column.chunks:
+            encoded = pc.struct_field(chunk, [bytes_field])
+            buffers = encoded.buffers()
+            offset_type = np.int64 if pa.types.is_large_binary(encoded.type) else np.int32
+            offsets = np.frombuffer(buffers[1], dtype=offset_type)[encoded.offset:encoded.offset + len(encoded) + 1]
+            data = np.frombuffer(buffers[2], dtype=np.uint8) if buffers[2] is not None else np.empty(0, np.uint8)
+
+            self._data.append(data)
+            self._offsets.append(offsets)
+            # Images stored as a path only (bytes not embedded)
+            self._nulls.append(encoded.is_null().to_numpy(zero_copy_only=False) if encoded.null_count else None)
+            self._paths.append(pc.struct_field(chunk, [path_field]))
+
+        self._starts = np.cumsum([0] + [len(chunk) for chunk in column.chunks])
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def encoded(self, idx):
+        """
+        Return the encoded image as a numpy view of the Arrow buffer, or its path if bytes are not embedded.
+        """
+        chunk = int(np.searchsorted(self._starts, idx, side='right')) - 1
+        row = idx - self._starts[chunk]
+        if self._nulls[chunk] is not None and self._nulls[chunk][row]:
+            return self._paths[chunk][row].as_py()
+        offsets = self._offsets[chunk]
+
+        return self._data[chunk][offsets[row]:offsets[row + 1]]
+
+    def __getitem__(self, idx):
+        return decode_image_bytes(self.encoded(idx), self.mode, self.draft_size)
+
+    def __getstate__(self):
+        # Only the dataset is pickled (by file reference if memory-mapped), buffers are read again
+        return {'dataset': self.dataset, 'column': self.column, 'draft_size': self.draft_size}
+
+    def __setstate__(self, state):
+        self.__init__(state['dataset'], state['column'], state['draft_size'])
+
+
+def get_image_reader(dataset: Dataset, draft_size: tuple = None):
+    """
+    Return an indexable of decoded images: an ArrowImageReader for HuggingFace datasets with an Image column,
+    otherwise the image of each dataset row (already decoded, draft_size is not used).
+    """
+    if isinstance(dataset, datasets.Dataset) and isinstance(dataset.features.get('image'), datasets.Image):
+        return ArrowImageReader(dataset, draft_size=draft_size)
+
+    return _RowImageReader(dataset)
+
+
+def get_draft_size(preprocess_transform: transforms) -> tuple:
+    """
+    Return the draft size (width, height) for reduced-scale decoding, taken from the Resize transformation
+    that comes first in preprocess_transform. Return None if the first transformation is not a Resize,
+    since the decoded size must then be preserved.
+
+    Example
+    -------
+    >>> get_draft_size(transforms.Compose([transforms.Resize(size=(256, 256)), transforms.ToTensor()]))
+    (256, 256)
+    """
+    first_transform = preprocess_transform
+    while isinstance(first_transform, transforms.Compose):
+        if not first_transform.transforms:
+            return None
+        first_transform = first_transform.transforms[0]
+
+    if not isinstance(first_transform, transforms.Resize):
+        return None
+
+    size = first_transform.size
+    # An int size is the size of the smaller edge
+    if isinstance(size, int) or len(size) == 1:
+        size = size if isinstance(size, int) else size[0]
+        return (size, size)
+
+    height, width = size
+    return (width, height)
+
+
+class _RowImageReader:
+    """
+    Image of each row of a map-style dataset.
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        return self.dataset[idx]['image']
+
+
+def resolve_data_files(dataset: str, part_set: str) -> list:
+    """
+    Return the local Arrow or Parquet files of a dataset split.
+    If dataset is a local directory, its files whose name contains part_set are returned.
+    Otherwise, the files of the HuggingFace cache are returned (downloaded if needed).
+    The Arrow files of the HuggingFace cache are memory-mapped, images are not decoded.
+
+    Parameters
+    ----------
+    dataset : str
+        HuggingFace dataset name or local directory
+    part_set : {'train', 'validation', 'test'}
+        Train, validation or test set
+
+    Returns
+    -------
+    list
+    """
+    # DatasetDict written by save_to_disk: one directory per split
+    if is_saved_dataset(dataset):
+        files = sorted(glob.glob(os.path.join(dataset, part_set, '*.arrow')))
+        if not files:
+            raise FileNotFoundError(f"No Arrow file for split '{part_set}' in {dataset}")
+        return files
+
+    if os.path.isdir(dataset):
+        files = [
+            file for extension in ('parquet', 'arrow')
+            for file in glob.glob(os.path.join(dataset, '**', f'*.{extension}'), recursive=True)
+            if part_set in os.path.basename(file)
+        ]
+        if not files:
+            raise FileNotFoundError(f"No Arrow or Parquet file for split '{part_set}' in {dataset}")
+        return files
+
+    return [cache_file['filename'] for cache_file in load_dataset(dataset, split=part_set).cache_files]
+
 
-        return {"image": data, "label": label}
+def _iter_record_batches(file: str, columns: list) -> Iterator:
+    """
+    Iterate over the record batches of an Arrow (stream or file format) or Parquet file.
+    """
+    if file.endswith('.parquet'):
+        yield from pq.ParquetFile(file).iter_batches(batch_size=256, columns=columns)
+        return
+
+    source = pa.memory_map(file)
+    try:
+        reader = pa.ipc.open_stream(source)
+        batches = iter(reader)
+    except pa.ArrowInvalid:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    for batch in batches:
+        yield batch.select(columns)
+
+
+def _count_rows(file: str) -> int:
+    """
+    Number of rows of an Arrow or Parquet file, without reading the images.
+    """
+    if file.endswith('.parquet'):
+        return pq.ParquetFile(file).metadata.num_rows
+    return sum(batch.num_rows for batch in _iter_record_batches(file, columns=['dx']))
     
 
 class AdjustContrast:
@@ -62,7 +981,126 @@ class AdjustContrast:
     def __call__(self, img):
         return adjust_contrast(img, self.contrast_factor)
 
-    
+    def __repr__(self):
+        return f"{self.__class__.__name__}(contrast_factor={self.contrast_factor})"
+
+
+class BatchAugmentation:
+    """
+    Data augmentation of the minority classes applied to a whole batch, to be used as DataLoader collate_fn.
+    Each minority class image gets one augmentation chosen at random (like transforms.RandomChoice) among
+    horizontal flip, rotation, and contrast adjustment with each contrast factor.
+    All images are then center cropped. Every operation is vectorized over the batch.
+
+    Example
+    -------
+    >>> batch_augmentation = BatchAugmentation(
+    >>>     minority_classes=[0, 3, 6],
+    >>>     degrees=(0, 180),
+    >>>     contrast_factors=(0.90, 1.10)
+    >>> )
+    >>> generate_dataloader(..., batch_augmentation=batch_augmentation)
+    """
+    def __init__(
+            self,
+            minority_classes: list,
+            degrees: tuple = (0, 180),
+            contrast_factors: tuple = (0.90, 1.10),
+            crop_size: int = 224
+        ):
+        self.minority_classes = torch.as_tensor(minority_classes)
+        self.degrees = degrees
+        self.contrast_factors = torch.as_tensor(contrast_factors, dtype=torch.float32)
+        self.crop_size = crop_size
+
+    def __call__(self, samples: list) -> dict:
+        batch = default_collate(samples)
+        batch['image'] = self.augment(batch['image'], batch['label'])
+
+        return batch
+
+    def augment(self, images: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+        """
+        Augment the minority class images of a batch and center crop the whole batch.
+        """
+        images = images.clone()
+        minority_idx = torch.isin(labels, self.minority_classes).nonzero().flatten()
+
+        if len(minority_idx) > 0:
+            # 0: flip, 1: rotation, 2 and more: contrast factor
+            choices = torch.randint(2 + len(self.contrast_factors), (len(minority_idx),))
+
+            flip_idx = minority_idx[choices == 0]
+            images[flip_idx] = images[flip_idx].flip(-1)
+
+            rotation_idx = minority_idx[choices == 1]
+            if len(rotation_idx) > 0:
+                angles = torch.empty(len(rotation_idx)).uniform_(*self.degrees)
+                images[rotation_idx] = self._rotate(images[rotation_idx], angles)
+
+            contrast_idx = minority_idx[choices >= 2]
+            if len(contrast_idx) > 0:
+                factors = self.contrast_factors[choices[choices >= 2] - 2]
+                images[contrast_idx] = self._adjust_contrast(images[contrast_idx], factors)
+
+        if self.crop_size is not None and images.size(-1) != self.crop_size:
+            images = center_crop(images, [self.crop_size, self.crop_size])
+
+        return images
+
+    @staticmethod
+    def _rotate(images: torch.Tensor, angles: torch.Tensor) -> torch.Tensor:
+        """
+        Rotate each image counter-clockwise by its angle (in degrees) around its center,
+        with nearest interpolation and black fill, as transforms.RandomRotation.
+        """
+        height, width = images.shape[-2:]
+        radians = torch.deg2rad(angles)
+        cos, sin = torch.cos(radians), torch.sin(radians)
+        zeros = torch.zeros_like(cos)
+        # Inverse rotation from output to input normalized coordinates
+        theta = torch.stack([
+            torch.stack([cos, -sin * height / width, zeros], dim=1),
+            torch.stack([sin * width / height, cos, zeros], dim=1)
+        ], dim=1)
+        grid = F.affine_grid(theta, list(images.shape), align_corners=False)
+        rotated = F.grid_sample(images.float(), grid, mode='nearest', padding_mode='zeros', align_corners=False)
+
+        return rotated.to(images.dtype)
+
+    @staticmethod
+    def _adjust_contrast(images: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+        """
+        Adjust the contrast of each image by its factor, as torchvision adjust_contrast.
+        """
+        r, g, b = images.unbind(dim=-3)
+        gray = 0.2989 * r + 0.587 * g + 0.114 * b
+        if not images.is_floating_point():
+            gray = gray.to(images.dtype)
+        mean = gray.float().mean(dim=(-2, -1)).view(-1, 1, 1, 1)
+        factors = factors.view(-1, 1, 1, 1)
+
+        bound = 1.0 if images.is_floating_point() else 255.0
+        blended = (factors * images + (1.0 - factors) * mean).clamp(0, bound)
+
+        return blended.to(images.dtype)
+
+
+
+class ToUint8:
+    """
+    Convert a float image in [0, 1] (as returned by ToTensor) to uint8 pixels.
+    Conversion is exact for images produced by ToTensor.
+    """
+    def __call__(self, img):
+        if img.dtype == torch.uint8:
+            return img
+        return img.mul(255).round_().to(torch.uint8)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}()"
+
+
 def generate_dataloader(
         dataset: Dataset,
         part_set: str,
@@ -72,13 +1110,35 @@ def generate_dataloader(
         transform: transforms,
         train: bool,
         batch_size: int,
-        shuffle: bool
+        shuffle: bool,
+        cache_dir: str = None,
+        compact: bool = False,
+        num_proc: int = None,
+        streaming: bool = False,
+        shuffle_buffer: int = 1000,
+        batch_augmentation: BatchAugmentation = None,
+        num_workers: int = 0,
+        persistent_workers: bool = False,
+        prefetch_factor: int = None,
+        pin_memory: bool = False,
+        worker_init_fn: Callable = None,
+        lazy: bool = False,
+        max_cache_bytes: int = 2**30,
+        draft: bool = False,
+        compress: str = None,
+        compress_quality: int = 95,
+        augment_variants: int = 0,
+        augment_seed: int = 0,
+        sampler: Union[str, Sampler] = None,
+        samples_per_epoch: int = None,
+        prune_keep_ratio: float = 0.5,
+        prune_refresh_every: int = 5
     ) -> DataLoader:
     """
     Parameters
     ----------
-    dataset : Dataset
-        HuggingFace dataset
+    dataset : str
+        HuggingFace dataset name, or local directory of images and metadata CSV (see load_local_dataset)
     part_set: {'train', 'validation', 'test'}
         Train, validation or test set
     preprocess_transform : list of Transform objects
@@ -95,6 +1155,67 @@ def generate_dataloader(
         Batch size
     shuffle : bool
         True to shuffle set during training phase.
+    cache_dir : str, default None
+        Directory of the preprocessed splits cache.
+        The first call writes the preprocessed images and encoded labels,
+        later calls memory-map them instead of preprocessing the split again.
+    compact : bool, default False
+        Set to True to store images as uint8 pixels instead of float32.
+        Images are converted to float per batch by the training functions.
+    num_proc : int, default None
+        Number of processes used to preprocess the images. None or 1 to preprocess serially.
+    streaming : bool, default False
+        Set to True to read the split from its local Arrow or Parquet files and preprocess images on the fly,
+        instead of preprocessing the whole split before training. See StreamingDataset.
+        dataset can then also be a local directory of Arrow or Parquet files.
+    shuffle_buffer : int, default 1000
+        Number of samples of the streaming shuffle buffer
+    batch_augmentation : BatchAugmentation, default None
+        Batch-level augmentation and crop, run in the collate function.
+        When set, transform is not applied per sample.
+    num_workers : int, default 0
+        Number of DataLoader worker processes. 0 to load data in the main process.
+    persistent_workers : bool, default False
+        Set to True to keep workers alive between epochs (requires num_workers > 0)
+    prefetch_factor : int, default None
+        Number of batches loaded in advance by each worker (requires num_workers > 0)
+    pin_memory : bool, default False
+        Set to True to copy batches into pinned memory, for faster transfers to the GPU
+    worker_init_fn : Callable, default None
+        Function called in each worker process with the worker id
+    lazy : bool, default False
+        Set to True to keep images encoded and decode them on access, see LazyImages.
+        cache_dir is not used in this mode. Requires persistent_workers with num_workers > 0.
+    max_cache_bytes : int, default 1 GiB
+        Size of the decoded images cache of the lazy mode (per DataLoader worker).
+        With shuffling, the split must fit in the cache of each worker for every image to be found there.
+    draft : bool, default False
+        Set to True to decode JPEG images at a reduced scale when the first preprocess transformation
+        is a Resize much smaller than the source image. Pixels differ slightly from full decoding.
+    compress : {None, 'jpeg', 'webp', 'png'}, default None
+        Set to keep preprocessed images encoded in memory and decode them on access, see CompressedImages.
+        Images are encoded by num_proc processes, and the encoded images are stored in cache_dir when set.
+        Not available in streaming or lazy mode.
+    compress_quality : int, default 95
+        JPEG and WebP quality of the compressed images
+    augment_variants : int, default 0
+        Number of augmentations precomputed for each minority class image of the train set.
+        Each time an image is loaded, one of its variants is picked instead of transforming it.
+        Variants are stored in cache_dir when set. 0 to transform images on the fly.
+        Not available in streaming mode or with a batch_augmentation.
+    augment_seed : int, default 0
+        Random seed of the precomputed augmentations
+    sampler : {None, 'balanced', 'pruning'} or Sampler, default None
+        'balanced' to draw samples_per_epoch samples per epoch, evenly split between classes
+        (see ClassBalancedSampler). 'pruning' to skip the samples with the lowest training loss,
+        except the minority classes (see LossPruningSampler): pass dataloader.sampler.loss_tracker to train_model.
+        shuffle is then ignored. Not available in streaming mode.
+    samples_per_epoch : int, default None
+        Number of samples per epoch of the balanced sampler
+    prune_keep_ratio : float, default 0.5
+        Fraction of the majority class samples kept by the pruning sampler
+    prune_refresh_every : int, default 5
+        Number of epochs between two epochs on all samples of the pruning sampler
 
     Returns
     -------
@@ -122,20 +1243,138 @@ def generate_dataloader(
     >>>     shuffle=True
     >>> )
     """
-    # Load train, validation or test set
-    dataset = load_dataset(dataset, split=part_set)
+    if compress is not None and (streaming or lazy):
+        raise ValueError("compress cannot be used in streaming or lazy mode, images are then kept encoded "
+                         "as in the dataset")
+    if augment_variants > 0 and (streaming or batch_augmentation is not None):
+        raise ValueError("Precomputed augmentations cannot be used in streaming mode or with a batch_augmentation, "
+                         "images are then augmented on the fly")
 
-    # Basic transformations on the dataset
-    set_images = import_and_preprocess_image(
-        dataset=dataset,
-        preprocess_transform=preprocess_transform
-    )
+    # Augmentation and crop are done per batch by the collate function
+    crop_size = 224
+    if batch_augmentation is not None:
+        transform, crop_size = None, None
 
-    # Extract labels from dataset
-    set_labels = extract_labels(
-        dataset=dataset,
-        label_encoder=label_encoder
-    )
+    if streaming and sampler is not None:
+        raise ValueError("A sampler cannot be used in streaming mode, samples are read in file order")
+    # Workers are started again at every epoch otherwise, with empty caches
+    if lazy and num_workers > 0 and not persistent_workers:
+        raise ValueError("The lazy mode requires persistent_workers=True with num_workers > 0, "
+                         "the decoded images cache of each worker is lost at the end of an epoch")
+
+    if streaming:
+        dataset = StreamingDataset(
+            files=resolve_data_files(dataset, part_set),
+            preprocess_transform=preprocess_transform,
+            label_encoder=label_encoder,
+            minority_classes=minority_classes,
+            train=part_set == 'train',
+            transform=transform,
+            shuffle=shuffle,
+            shuffle_buffer=shuffle_buffer,
+            compact=compact,
+            crop_size=crop_size,
+            draft=draft
+        )
+        # Shuffling is done by the dataset itself
+        return create_dataloader(
+            dataset=dataset,
+            batch_size=batch_size,
+            shuffle=False,
+            collate_fn=batch_augmentation,
+            num_workers=num_workers,
+            persistent_workers=persistent_workers,
+            prefetch_factor=prefetch_factor,
+            pin_memory=pin_memory,
+            worker_init_fn=worker_init_fn
+        )
+
+    dataset_name = dataset
+    cached = None
+    if cache_dir is not None and not lazy:
+        key = cache_key(dataset, part_set, preprocess_transform, compact, draft)
+        cached = load_cached_split(cache_dir, key, label_encoder)
+
+    if lazy:
+        # Keep the encoded images, decode them on access
+        dataset = load_split(dataset, part_set)
+        set_images = LazyImages(
+            dataset=dataset,
+            preprocess_transform=preprocess_transform,
+            compact=compact,
+            max_cache_bytes=max_cache_bytes,
+            draft=draft
+        )
+        set_labels = extract_labels(
+            dataset=dataset,
+            label_encoder=label_encoder
+        )
+    elif cached is not None:
+        set_images, set_labels = cached
+    else:
+        # Load train, validation or test set
+        dataset = load_split(dataset, part_set)
+
+        # Basic transformations on the dataset
+        set_images = import_and_preprocess_image(
+            dataset=dataset,
+            preprocess_transform=preprocess_transform,
+            compact=compact,
+            num_proc=num_proc,
+            draft=draft
+        )
+
+        # Extract labels from dataset
+        set_labels = extract_labels(
+            dataset=dataset,
+            label_encoder=label_encoder
+        )
+
+        # Save the split, then reopen it memory-mapped to release the in-memory copy
+        if cache_dir is not None:
+            save_cached_split(cache_dir, key, set_images, set_labels, label_encoder)
+            set_images, set_labels = load_cached_split(cache_dir, key, label_encoder)
+
+    # Precompute the augmentations of the minority classes
+    variants = None
+    if augment_variants > 0 and part_set == 'train' and transform is not None:
+        augment_mask = torch.isin(set_labels, torch.as_tensor(minority_classes, dtype=set_labels.dtype))
+        if cache_dir is not None:
+            variants_key = augmentation_key(
+                cache_key(dataset_name, part_set, preprocess_transform, compact, draft),
+                transform, augment_variants, augment_mask, augment_seed
+            )
+            cached = load_cached_split(cache_dir, variants_key, label_encoder)
+            if cached is not None:
+                variants = cached[0]
+        if variants is None:
+            variants = precompute_augmentations(set_images, augment_mask, transform, augment_variants, augment_seed)
+            if cache_dir is not None:
+                variants_labels = set_labels[augment_mask].repeat_interleave(augment_variants)
+                save_cached_split(cache_dir, variants_key, variants, variants_labels, label_encoder)
+                variants, _ = load_cached_split(cache_dir, variants_key, label_encoder)
+
+    # Keep preprocessed images encoded in memory
+    if compress is not None:
+        encoded = None
+        if cache_dir is not None:
+            compress_key = compression_key(
+                cache_key(dataset_name, part_set, preprocess_transform, compact, draft),
+                compress, compress_quality, len(set_images)
+            )
+            encoded = load_compressed_images(cache_dir, compress_key)
+        if encoded is not None:
+            set_images = CompressedImages(*encoded, compact=compact)
+        else:
+            set_images = CompressedImages.from_tensor(
+                images=set_images,
+                image_format=compress,
+                quality=compress_quality,
+                compact=compact,
+                num_proc=num_proc
+            )
+            if cache_dir is not None:
+                save_compressed_images(cache_dir, compress_key, set_images.buffer, set_images.offsets)
 
     # Create train dataset with data augmentation
     dataset = create_torch_dataset(
@@ -144,21 +1383,359 @@ def generate_dataloader(
         part_set=part_set,
         minority_classes=minority_classes,
         train=train,
-        transform=transform
+        transform=transform,
+        crop_size=crop_size,
+        variants=variants
     )
 
+    if sampler == 'balanced':
+        sampler = ClassBalancedSampler(dataset.class_indices, num_samples=samples_per_epoch)
+    elif sampler == 'pruning':
+        minority = [dataset.class_indices[c] for c in minority_classes if c in dataset.class_indices]
+        sampler = LossPruningSampler(
+            loss_tracker=LossTracker(len(dataset)),
+            keep_ratio=prune_keep_ratio,
+            refresh_every=prune_refresh_every,
+            protected_indices=torch.cat(minority) if minority else None
+        )
+
     dataloader = create_dataloader(
         dataset=dataset,
         batch_size=batch_size,
-        shuffle=shuffle
+        shuffle=shuffle,
+        sampler=sampler,
+        collate_fn=batch_augmentation,
+        num_workers=num_workers,
+        persistent_workers=persistent_workers,
+        prefetch_factor=prefetch_factor,
+        pin_memory=pin_memory,
+        worker_init_fn=worker_init_fn
     )
 
     return dataloader
 
 
+def generate_dataloaders(
+        dataset: str,
+        preprocess_transform: transforms,
+        label_encoder: LabelEncoder,
+        minority_classes: list,
+        part_set_transforms: dict,
+        batch_size: int,
+        shuffle: bool,
+        part_sets: tuple = ('train', 'validation', 'test'),
+        cache_dir: str = None,
+        compact: bool = False,
+        num_proc: int = None,
+        draft: bool = False,
+        batch_augmentation: BatchAugmentation = None,
+        num_workers: int = 0,
+        persistent_workers: bool = False,
+        prefetch_factor: int = None,
+        pin_memory: bool = False,
+        worker_init_fn: Callable = None
+    ) -> dict:
+    """
+    Create the DataLoader of every part set with a single load of the dataset.
+    The label encoder is fitted once on the first part set (train), then every part set not found
+    in the cache is preprocessed in one pass, with one pool of processes shared by all part sets.
+    See generate_dataloader for the other parameters.
+
+    Parameters
+    ----------
+    dataset : str
+        HuggingFace dataset name
+    part_set_transforms : dict
+        Transformation to apply to each part set
+    part_sets : tuple, default ('train', 'validation', 'test')
+        Part sets to load, the label encoder is fitted on the first one
+    batch_augmentation : BatchAugmentation, default None
+        Batch-level augmentation of the train set
+
+    Returns
+    -------
+    dict : DataLoader of each part set
+
+    Example
+    -------
+    >>> dataloaders = generate_dataloaders(
+    >>>     dataset='marmal88/skin_cancer',
+    >>>     preprocess_transform=preprocess_transform,
+    >>>     label_encoder=le,
+    >>>     minority_classes=[0, 3, 6],
+    >>>     part_set_transforms={
+    >>>         'train': train_transform,
+    >>>         'validation': val_test_transform,
+    >>>         'test': val_test_transform
+    >>>     },
+    >>>     batch_size=64,
+    >>>     shuffle=True,
+    >>>     num_proc=8
+    >>> )
+    >>> train_dataloader = dataloaders['train']
+    """
+    set_images, set_labels, keys = {}, {}, {}
+
+    # Part sets already preprocessed
+    if cache_dir is not None:
+        for part_set in part_sets:
+            keys[part_set] = cache_key(dataset, part_set, preprocess_transform, compact, draft)
+            cached = load_cached_split(cache_dir, keys[part_set], label_encoder)
+            if cached is not None:
+                set_images[part_set], set_labels[part_set] = cached
+
+    missing = [part_set for part_set in part_sets if part_set not in set_images]
+
+    if missing:
+        # Single load of every part set
+        dataset_dict = load_splits(dataset, missing)
+
+        # Label encoder is fitted on the first part set, then only transforms
+        for part_set in missing:
+            set_labels[part_set] = extract_labels(
+                dataset=dataset_dict[part_set],
+                label_encoder=label_encoder
+            )
+
+        set_images.update(preprocess_splits(
+            splits={part_set: dataset_dict[part_set] for part_set in missing},
+            transform=preprocess_transform if preprocess_transform is not None else transforms.ToTensor(),
+            compact=compact,
+            num_proc=num_proc,
+            draft=draft
+        ))
+
+        # Save the part sets, then reopen them memory-mapped to release the in-memory copies
+        if cache_dir is not None:
+            for part_set in missing:
+                save_cached_split(cache_dir, keys[part_set], set_images[part_set], set_labels[part_set], label_encoder)
+                set_images[part_set], set_labels[part_set] = load_cached_split(
+                    cache_dir, keys[part_set], label_encoder
+                )
+
+    dataloaders = {}
+    for part_set in part_sets:
+        # Augmentation and crop of the train set are done per batch by the collate function
+        transform, crop_size, collate_fn = part_set_transforms.get(part_set), 224, None
+        if part_set == 'train' and batch_augmentation is not None:
+            transform, crop_size, collate_fn = None, None, batch_augmentation
+
+        part_dataset = create_torch_dataset(
+            data=set_images[part_set],
+            label=set_labels[part_set],
+            part_set=part_set,
+            minority_classes=minority_classes,
+            train=part_set == 'train',
+            transform=transform,
+            crop_size=crop_size
+        )
+
+        dataloaders[part_set] = create_dataloader(
+            dataset=part_dataset,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            collate_fn=collate_fn,
+            num_workers=num_workers,
+            persistent_workers=persistent_workers,
+            prefetch_factor=prefetch_factor,
+            pin_memory=pin_memory,
+            worker_init_fn=worker_init_fn
+        )
+
+    return dataloaders
+
+
+def append_to_cache(
+        new_data: datasets.Dataset,
+        cache_dir: str,
+        dataset: str,
+        part_set: str,
+        preprocess_transform: transforms,
+        label_encoder: LabelEncoder,
+        compact: bool = False,
+        num_proc: int = None,
+        draft: bool = False
+    ) -> str:
+    """
+    Preprocess new samples and append them to a cached split, without preprocessing the split again.
+    The label encoder is extended with the new classes, after the known ones (see extend_label_encoder).
+    The next generate_dataloader call with the same cache_dir reads the whole split.
+
+    Parameters
+    ----------
+    new_data : datasets.Dataset
+        New samples, with the image and dx columns of the dataset
+    cache_dir : str
+        Directory of the preprocessed splits cache
+    dataset, part_set, preprocess_transform, compact, draft
+        Parameters of the generate_dataloader call that cached the split
+    label_encoder : LabelEncoder
+        Label encoder
+    num_proc : int, default None
+        Number of preprocessing processes
+
+    Returns
+    -------
+    str : Path of the cache entry
+
+    Example
+    -------
+    >>> new_lesions = load_local_dataset('new_lesions', 'train')
+    >>> append_to_cache(new_lesions, 'cache', 'marmal88/skin_cancer', 'train', preprocess_transform, le)
+    """
+    key = cache_key(dataset, part_set, preprocess_transform, compact, draft)
+    cached_classes = load_cached_classes(cache_dir, key)
+    if cached_classes is None:
+        raise FileNotFoundError(f"No cache entry {key} in {cache_dir}, call generate_dataloader with cache_dir first")
+
+    # Classes of the new samples
+    feature = new_data.features['dx']
+    classes = new_data.unique('dx')
+    if isinstance(feature, datasets.ClassLabel):
+        classes = [feature.int2str(c) for c in classes]
+    # New classes are encoded after the known ones, the codes of the cached classes do not change
+    if not hasattr(label_encoder, 'classes_'):
+        set_label_classes(label_encoder, cached_classes)
+    extend_label_encoder(label_encoder, sorted(classes))
+
+    images = import_and_preprocess_image(
+        dataset=new_data,
+        preprocess_transform=preprocess_transform,
+        compact=compact,
+        num_proc=num_proc,
+        draft=draft
+    )
+    labels = extract_labels(
+        dataset=new_data,
+        label_encoder=label_encoder
+    )
+
+    return append_cached_split(cache_dir, key, images, labels, label_encoder)
+
+
+def load_split(dataset: str, part_set: str) -> datasets.Dataset:
+    """
+    Load a part set from a local directory of images with a metadata CSV (see load_local_dataset),
+    from a DatasetDict saved with save_to_disk, or otherwise with HuggingFace load_dataset.
+
+    Parameters
+    ----------
+    dataset : str
+        HuggingFace dataset name, local directory or save_to_disk directory
+    part_set : {'train', 'validation', 'test'}
+        Train, validation or test set
+
+    Returns
+    -------
+    datasets.Dataset
+    """
+    if is_local_image_dataset(dataset):
+        return load_local_dataset(dataset, part_set)
+    if is_saved_dataset(dataset):
+        return datasets.load_from_disk(os.path.join(dataset, part_set))
+
+    return load_dataset(dataset, split=part_set)
+
+
+def load_splits(dataset: str, part_sets: list) -> dict:
+    """
+    Load several part sets with a single HuggingFace load_dataset call, see load_split.
+
+    Returns
+    -------
+    dict : datasets.Dataset of each part set
+    """
+    if is_local_image_dataset(dataset):
+        return {part_set: load_local_dataset(dataset, part_set) for part_set in part_sets}
+    if is_saved_dataset(dataset):
+        return {part_set: load_split(dataset, part_set) for part_set in part_sets}
+
+    dataset_dict = load_dataset(dataset)
+
+    return {part_set: dataset_dict[part_set] for part_set in part_sets}
+
+
+def is_local_image_dataset(dataset: str) -> bool:
+    """
+    Return True if dataset is a local directory containing metadata CSV files.
+    """
+    return os.path.isdir(dataset) and len(glob.glob(os.path.join(dataset, '*.csv'))) > 0
+
+
+def is_saved_dataset(dataset: str) -> bool:
+    """
+    Return True if dataset is a DatasetDict directory written by save_to_disk.
+    """
+    return os.path.isfile(os.path.join(dataset, 'dataset_dict.json'))
+
+
+def load_local_dataset(
+        data_dir: str,
+        part_set: str,
+        metadata_file: str = 'HAM10000_metadata.csv'
+    ) -> datasets.Dataset:
+    """
+    Load a part set from a local directory of images and a HAM10000-style metadata CSV
+    (image_id, dx, ...), without any HuggingFace hub access.
+    Rows are read from <part_set>.csv if it exists, otherwise from the rows of metadata_file
+    whose 'split' column equals part_set.
+    Images are searched recursively in data_dir as <image_id>.jpg (or .jpeg, .png).
+    The returned dataset has the same 'image' and 'dx' columns as the HuggingFace dataset,
+    images are only decoded during preprocessing.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory containing the images and the metadata CSV files
+    part_set : {'train', 'validation', 'test'}
+        Train, validation or test set
+    metadata_file : str, default 'HAM10000_metadata.csv'
+        Metadata CSV with a 'split' column, used when there is no <part_set>.csv
+
+    Returns
+    -------
+    datasets.Dataset
+
+    Example
+    -------
+    >>> # data/HAM10000_images_part_1/ISIC_0027419.jpg, ..., data/train.csv, data/validation.csv, data/test.csv
+    >>> generate_dataloader(dataset='data', part_set='train', ...)
+    """
+    split_file = os.path.join(data_dir, f"{part_set}.csv")
+    if os.path.exists(split_file):
+        metadata = pd.read_csv(split_file)
+    else:
+        metadata = pd.read_csv(os.path.join(data_dir, metadata_file))
+        if 'split' not in metadata.columns:
+            raise ValueError(f"No {part_set}.csv in {data_dir} and no 'split' column in {metadata_file}")
+        metadata = metadata[metadata['split'] == part_set].drop(columns='split')
+
+    # Path of every image of the directory, by image id
+    image_paths = {}
+    for root, _, files in os.walk(data_dir):
+        for file in files:
+            image_id, extension = os.path.splitext(file)
+            if extension.lower() in ('.jpg', '.jpeg', '.png'):
+                image_paths[image_id] = os.path.join(root, file)
+
+    missing = [image_id for image_id in metadata['image_id'] if image_id not in image_paths]
+    if missing:
+        raise FileNotFoundError(f"{len(missing)} images of {part_set} not found in {data_dir}, e.g. {missing[0]}")
+
+    metadata = metadata.reset_index(drop=True)
+    metadata.insert(0, 'image', [image_paths[image_id] for image_id in metadata['image_id']])
+
+    dataset = datasets.Dataset.from_pandas(metadata, preserve_index=False)
+
+    return dataset.cast_column('image', datasets.Image())
+
+
 def import_and_preprocess_image(
         dataset: datasets.Dataset,
-        preprocess_transform: transforms
+        preprocess_transform: transforms,
+        compact: bool = False,
+        num_proc: int = None,
+        draft: bool = False
     ) -> Tuple[torch.Tensor]:
     """
     Transform and preprocess the data.
@@ -169,6 +1746,12 @@ def import_and_preprocess_image(
         Dataset with data and label as a TensorDataset object
     transformations : list of transforms objects
         List of transformations to be applied to the dataset
+    compact : bool, default False
+        Set to True to return uint8 pixels instead of float32
+    num_proc : int, default None
+        Number of preprocessing processes
+    draft : bool, default False
+        Set to True to decode JPEG images at a reduced scale
 
     Returns
     -------
@@ -179,17 +1762,30 @@ def import_and_preprocess_image(
         preprocess_transform = transforms.ToTensor()
     
     # Preprocess the data in a comprehension list, then turn it into a numpy array and finally in a torch.Tensor
-    image_set = image_to_torch(dataset=dataset, transform=preprocess_transform)
+    image_set = image_to_torch(
+        dataset=dataset,
+        transform=preprocess_transform,
+        compact=compact,
+        num_proc=num_proc,
+        draft=draft
+    )
 
     return image_set
 
 
 def image_to_torch(
         dataset: Dataset,  
-        transform: transforms
+        transform: transforms,
+        compact: bool = False,
+        num_proc: int = None,
+        draft: bool = False
     ) -> torch.Tensor:
     """
     Converts image dataset to a torch tensor.
+    The output tensor is allocated once and each image is written directly into its slot,
+    so peak memory stays close to the size of the output tensor.
+    With num_proc > 1, the dataset is split in contiguous chunks preprocessed by a pool of processes.
+    Each chunk is copied into the output as soon as it is ready, so the result is identical to the serial path.
 
     Parameters
     ----------
@@ -197,6 +1793,13 @@ def image_to_torch(
         Dataset to transform.
     transform : torch.transforms
         Transformations to apply.
+    compact : bool, default False
+        Set to True to convert images to uint8 pixels.
+    num_proc : int, default None
+        Number of processes. None or 1 to preprocess in the current process.
+    draft : bool, default False
+        Set to True to decode JPEG images at the smallest DCT scale still larger than the first Resize
+        of transform (see get_draft_size), instead of decoding full resolution pixels then shrinking them.
 
     Returns
     -------
@@ -210,15 +1813,129 @@ def image_to_torch(
     >>>                   ])
     >>> image_to_torch(dataset, 'train', transformations)
     """
-    torch_tensor = torch.from_numpy(
-        np.array(
-            [transform(dataset[idx]['image']) for idx in range(len(dataset))]
-        )
-    )
+    torch_tensor = preprocess_splits(
+        splits={'images': dataset},
+        transform=transform,
+        compact=compact,
+        num_proc=num_proc,
+        draft=draft
+    )['images']
 
     return torch_tensor
 
 
+def preprocess_splits(
+        splits: dict,
+        transform: transforms,
+        compact: bool = False,
+        num_proc: int = None,
+        draft: bool = False
+    ) -> dict:
+    """
+    Preprocess the images of several datasets (such as the splits of a DatasetDict) in one pass.
+    With num_proc > 1, the chunks of every dataset go through the same pool of processes.
+    See image_to_torch for the parameters.
+
+    Parameters
+    ----------
+    splits : dict
+        Datasets to preprocess, by name
+
+    Returns
+    -------
+    dict : Images tensor of each dataset, by name
+    """
+    draft_size = get_draft_size(transform) if draft else None
+
+    if compact:
+        transform = transforms.Compose([transform, ToUint8()])
+
+    parallel = num_proc is not None and num_proc > 1
+    readers, outputs, tasks = {}, {}, []
+
+    for name, dataset in splits.items():
+        n_images = len(dataset)
+        if n_images == 0:
+            outputs[name] = torch.empty(0)
+            continue
+
+        # Decoded images read from the Arrow buffers
+        readers[name] = get_image_reader(dataset, draft_size)
+
+        # Preprocess the first image to know the output shape and dtype
+        first_image = torch.as_tensor(transform(readers[name][0]))
+        outputs[name] = torch.empty((n_images, *first_image.shape), dtype=first_image.dtype)
+        outputs[name][0] = first_image
+
+        if not parallel:
+            _preprocess_chunk(readers[name], transform, 1, n_images, out=outputs[name][1:])
+            continue
+
+        # Several chunks per process to balance the load, and small enough chunks to bound the memory in flight
+        n_chunks = min(n_images - 1, max(num_proc * 4, -(-n_images // PREPROCESS_CHUNK_SIZE)))
+        bounds = np.linspace(1, n_images, n_chunks + 1, dtype=int)
+        tasks.extend((name, start, stop) for start, stop in zip(bounds[:-1], bounds[1:]))
+
+    if tasks:
+        # Image readers and transform are sent once per process, not once per chunk
+        with ProcessPoolExecutor(
+            max_workers=num_proc,
+            initializer=_init_preprocess_worker,
+            initargs=(readers, transform)
+        ) as executor:
+            # At most 2 chunks per process in flight: finished chunks are copied as soon as they complete,
+            # and a slow chunk does not let the others pile up in memory
+            pending, remaining = {}, iter(tasks)
+            for task in remaining:
+                pending[executor.submit(_preprocess_worker_chunk, *task)] = task
+                if len(pending) < 2 * num_proc:
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, start, stop = pending.pop(future)
+                    outputs[name][start:stop] = torch.from_numpy(future.result())
+            for future in list(pending):
+                name, start, stop = pending.pop(future)
+                outputs[name][start:stop] = torch.from_numpy(future.result())
+
+    return outputs
+
+
+def _preprocess_chunk(images, transform, start, stop, out=None):
+    """
+    Preprocess images from start to stop and write them into out.
+    If out is None, a new tensor is allocated.
+    """
+    for i, idx in enumerate(range(start, stop)):
+        image = torch.as_tensor(transform(images[idx]))
+        if out is None:
+            out = torch.empty((stop - start, *image.shape), dtype=image.dtype)
+        out[i] = image
+
+    return out
+
+
+_worker_state = {}
+
+
+def _init_preprocess_worker(readers, transform):
+    """
+    Store the image readers and transform in the preprocessing process.
+    """
+    # One thread per process, parallelism comes from the processes
+    torch.set_num_threads(1)
+    _worker_state['readers'] = readers
+    _worker_state['transform'] = transform
+
+
+def _preprocess_worker_chunk(name, start, stop):
+    """
+    Preprocess a chunk of images of one dataset in a preprocessing process.
+    The chunk is returned as a numpy array to be pickled back to the main process.
+    """
+    return _preprocess_chunk(_worker_state['readers'][name], _worker_state['transform'], start, stop).numpy()
+
+
 def extract_labels(
         dataset: Dataset,
         label_encoder: LabelEncoder
@@ -227,6 +1944,9 @@ def extract_labels(
     Extract labels from the dataset and convert them into numerical values.
     Returns labels encoded as torch.Tensor
 
+    For HuggingFace datasets, the label column is dictionary-encoded by Arrow: only the distinct labels
+    go through the label encoder, and no Python object is created per row.
+
     Parameters
     ----------
     dataset : HuggingFace Dataset
@@ -239,6 +1959,9 @@ def extract_labels(
     torch.Tensor
     """
 
+    if isinstance(dataset, datasets.Dataset):
+        return _extract_arrow_labels(dataset, label_encoder)
+
     # If label encoder has already been fitted
     if not hasattr(label_encoder, 'classes_'):
         labels = torch.from_numpy(label_encoder.fit_transform(np.array(dataset['dx'])))
@@ -249,13 +1972,50 @@ def extract_labels(
     return labels
 
 
+def _extract_arrow_labels(dataset: datasets.Dataset, label_encoder: LabelEncoder, column: str = 'dx') -> torch.Tensor:
+    """
+    Encode the label column of a HuggingFace dataset from its Arrow dictionary encoding.
+    ClassLabel columns are already integers and only their names are encoded.
+    """
+    feature = dataset.features[column]
+    # Only the label column: the indices mapping of a shuffled or filtered dataset would copy the images too
+    labels = dataset.select_columns([column]).with_format('arrow')[:].column(column)
+
+    if isinstance(feature, datasets.ClassLabel):
+        names = np.array(feature.names)
+        present = pc.unique(labels).to_numpy()
+        if not hasattr(label_encoder, 'classes_'):
+            label_encoder.fit(names[present])
+        # Encoded label of each ClassLabel integer
+        lookup = np.full(len(names), -1, dtype=np.int64)
+        lookup[present] = label_encoder.transform(names[present])
+        return torch.from_numpy(lookup[labels.to_numpy()])
+
+    # The label encoder sorts the classes, fitting on the distinct labels is the same as fitting on the column
+    if not hasattr(label_encoder, 'classes_'):
+        label_encoder.fit(pc.unique(labels).to_numpy(zero_copy_only=False))
+
+    codes = np.empty(len(labels), dtype=np.int64)
+    start = 0
+    for chunk in labels.chunks:
+        encoded = chunk.dictionary_encode()
+        # Only the distinct labels of the chunk go through the label encoder
+        mapping = label_encoder.transform(encoded.dictionary.to_numpy(zero_copy_only=False)).astype(np.int64)
+        codes[start:start + len(chunk)] = mapping[encoded.indices.to_numpy()]
+        start += len(chunk)
+
+    return torch.from_numpy(codes)
+
+
 def create_torch_dataset(
         data: torch.Tensor,
         label: torch.Tensor,
         part_set: str,
         minority_classes: list,
         train: bool,
-        transform: transforms
+        transform: transforms,
+        crop_size: int = 224,
+        variants: torch.Tensor = None
     ) -> Dataset:
     """
     Create a pytorch dataset with possible transformations.
@@ -274,6 +2034,10 @@ def create_torch_dataset(
         Set to True if training set
     transform : transforms
         Transformations to apply
+    crop_size : int, default 224
+        Size of the center crop. None to not crop images.
+    variants : torch.Tensor, default None
+        Precomputed augmentations of the training images, see precompute_augmentations
         
     Returns
     -------
@@ -288,13 +2052,27 @@ def create_torch_dataset(
         tensors=(data, label),
         minority_classes=minority_classes,
         train=train,
-        transform=transform
+        transform=transform,
+        crop_size=crop_size,
+        variants=variants if train else None
     )
 
     return dataset
 
 
-def create_dataloader(dataset: Dataset = None, batch_size: int = 32, shuffle: bool = True) -> DataLoader:
+def create_dataloader(
+        dataset: Dataset = None,
+        batch_size: int = 32,
+        shuffle: bool = True,
+        collate_fn: Callable = None,
+        num_workers: int = 0,
+        persistent_workers: bool = False,
+        prefetch_factor: int = None,
+        pin_memory: bool = False,
+        worker_init_fn: Callable = None,
+        sampler: Sampler = None,
+        multiprocessing_context: str = None
+    ) -> DataLoader:
     """
     Create a DataLoader object.
 
@@ -306,13 +2084,52 @@ def create_dataloader(dataset: Dataset = None, batch_size: int = 32, shuffle: bo
         Batch size
     shuffle : bool
         Set to True to have the data reshuffled at every epoch.
+    collate_fn : Callable, default None
+        Function merging samples into a batch, such as a BatchAugmentation
+    num_workers : int, default 0
+        Number of worker processes. 0 to load data in the main process.
+    persistent_workers : bool, default False
+        Set to True to keep workers alive between epochs
+    prefetch_factor : int, default None
+        Number of batches loaded in advance by each worker
+    pin_memory : bool, default False
+        Set to True to copy batches into pinned memory
+    worker_init_fn : Callable, default None
+        Function called in each worker process with the worker id
+    sampler : Sampler, default None
+        Order of the samples, such as a ClassBalancedSampler. shuffle is then ignored.
+    multiprocessing_context : str, default None
+        Start method of the worker processes ('fork', 'spawn' or 'forkserver'). None for the default one.
 
     Returns
     -------
     DataLoader
     """
+    if num_workers > 0 and hasattr(dataset, 'share_memory'):
+        if multiprocessing_context is None:
+            start_method = multiprocessing.get_start_method()
+        elif isinstance(multiprocessing_context, str):
+            start_method = multiprocessing_context
+        else:
+            start_method = multiprocessing_context.get_start_method()
+        # Spawned workers would each receive a copy of the dataset, forked workers share it copy-on-write
+        if start_method != 'fork':
+            dataset.share_memory()
 
-    dataloader = DataLoader(dataset=dataset, batch_size=batch_size, shuffle=shuffle)
+    dataloader = DataLoader(
+        dataset=dataset,
+        batch_size=batch_size,
+        # The sampler defines the order of the samples
+        shuffle=shuffle if sampler is None else False,
+        sampler=sampler,
+        collate_fn=collate_fn,
+        num_workers=num_workers,
+        persistent_workers=persistent_workers,
+        prefetch_factor=prefetch_factor,
+        pin_memory=pin_memory,
+        worker_init_fn=worker_init_fn,
+        multiprocessing_context=multiprocessing_context
+    )
 
     return dataloader
 
@@ -340,4 +2157,54 @@ def get_labels_mapping(labelencoder: LabelEncoder) -> dict:
     {0: 'label1', 1: 'label2', 2: 'label3'}
     """
 
-    return dict(zip(labelencoder.transform(labelencoder.classes_), labelencoder.classes_))
\ No newline at end of file
+    return dict(zip(labelencoder.transform(labelencoder.classes_), labelencoder.classes_))
+
+
+def save_label_mapping(labelencoder: LabelEncoder, path: str) -> None:
+    """
+    Save the classes of a fitted label encoder in a JSON file, in encoding order.
+
+    Parameters
+    ----------
+    labelencoder : LabelEncoder
+        Fitted scikit-learn LabelEncoder
+    path : str
+        JSON file
+
+    Example
+    -------
+    >>> save_label_mapping(le, 'Models/label_mapping.json')
+    """
+    with open(path, 'w') as f:
+        json.dump([str(c) for c in labelencoder.classes_], f, indent=2)
+
+
+def load_label_mapping(path: str, labelencoder: LabelEncoder = None) -> LabelEncoder:
+    """
+    Load the classes saved by save_label_mapping in a label encoder,
+    so that labels are encoded the same way as when the mapping was saved.
+
+    Parameters
+    ----------
+    path : str
+        JSON file
+    labelencoder : LabelEncoder, default None
+        Label encoder to fit. A new one is created if None.
+
+    Returns
+    -------
+    LabelEncoder
+
+    Example
+    -------
+    >>> le = load_label_mapping('Models/label_mapping.json')
+    >>> generate_dataloader(..., label_encoder=le, ...)
+    """
+    if labelencoder is None:
+        labelencoder = LabelEncoder()
+
+    # Classes may not be sorted if the encoder was extended, see extend_label_encoder
+    with open(path) as f:
+        set_label_classes(labelencoder, json.load(f))
+
+    return labelencoder
\ No newline at end of file
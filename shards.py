@@ -0,0 +1,194 @@
+from typing import Iterator
+
+import io
+import os
+import json
+import tarfile
+
+import torch
+from torch.utils.data import Dataset, IterableDataset
+
+from torchvision.transforms import transforms
+
+from sklearn.preprocessing import LabelEncoder
+
+from preprocessing import (
+    assign_worker_shards, shuffle_buffer, transform_sample, encode_image, decode_image_tensor
+)
+
+
+MANIFEST_FILE = 'index.json'
+
+
+def export_shards(
+        dataset: Dataset,
+        output_dir: str,
+        samples_per_shard: int = 1000,
+        image_format: str = 'png',
+        quality: int = 95,
+        label_encoder: LabelEncoder = None
+    ) -> list:
+    """
+    Export a preprocessed part set into tar shards of samples_per_shard samples.
+    Each sample is stored as three consecutive members: <key>.<image_format> (encoded image),
+    <key>.cls (encoded label) and <key>.json (metadata).
+    A manifest (index.json) lists the shards and their number of samples.
+
+    Parameters
+    ----------
+    dataset : Dataset
+        CustomDataset with images and labels tensors
+    output_dir : str
+        Output directory
+    samples_per_shard : int, default 1000
+        Number of samples per shard
+    image_format : {'png', 'jpeg', 'webp'}, default 'png'
+        Image encoding. PNG is lossless.
+    quality : int, default 95
+        JPEG and WebP quality
+    label_encoder : LabelEncoder, default None
+        Fitted label encoder, to store class names in the metadata
+
+    Returns
+    -------
+    list : Shards paths
+
+    Example
+    -------
+    >>> train_dataloader = generate_dataloader(..., compact=True)
+    >>> export_shards(train_dataloader.dataset, 'shards/train', samples_per_shard=1000, label_encoder=le)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    images, labels = dataset.tensors
+    classes = [str(c) for c in label_encoder.classes_] if label_encoder is not None else None
+
+    shards = []
+    for shard_idx, start in enumerate(range(0, len(labels), samples_per_shard)):
+        stop = min(start + samples_per_shard, len(labels))
+        file = f"shard-{shard_idx:06d}.tar"
+
+        # Written under a temporary name, a reader never sees a partial shard
+        tmp_path = os.path.join(output_dir, f"{file}.tmp")
+        with tarfile.open(tmp_path, mode='w') as tar:
+            for idx in range(start, stop):
+                key = f"{idx:09d}"
+                label = int(labels[idx])
+                metadata = {'index': idx, 'label': label}
+                if classes is not None:
+                    metadata['dx'] = classes[label]
+
+                _add_member(tar, f"{key}.{image_format}", encode_image(images[idx], image_format, quality))
+                _add_member(tar, f"{key}.cls", str(label).encode('utf-8'))
+                _add_member(tar, f"{key}.json", json.dumps(metadata).encode('utf-8'))
+        os.replace(tmp_path, os.path.join(output_dir, file))
+
+        shards.append({'file': file, 'num_samples': stop - start})
+
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w') as f:
+        json.dump({'shards': shards, 'classes': classes, 'image_format': image_format}, f, indent=2)
+
+    return [os.path.join(output_dir, shard['file']) for shard in shards]
+
+
+def _add_member(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    """
+    Add a file member from bytes.
+    """
+    info = tarfile.TarInfo(name=name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+class ShardDataset(IterableDataset):
+    """
+    Streaming dataset reading the tar shards written by export_shards.
+    Shards are read sequentially and split between DataLoader workers, samples are shuffled through
+    a bounded buffer, and images are decoded on the fly, so the part set is never held in memory.
+
+    Example
+    -------
+    >>> dataset = ShardDataset(
+    >>>     shard_dir='shards/train',
+    >>>     minority_classes=[0, 3, 6],
+    >>>     train=True,
+    >>>     transform=train_transform
+    >>> )
+    >>> train_dataloader = create_dataloader(dataset=dataset, batch_size=64, shuffle=False, num_workers=8)
+    """
+    def __init__(
+            self,
+            shard_dir: str,
+            minority_classes: list,
+            train: bool,
+            transform: transforms,
+            shuffle: bool = True,
+            shuffle_buffer: int = 1000,
+            compact: bool = False,
+            crop_size: int = 224
+        ):
+        with open(os.path.join(shard_dir, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+
+        self.files = [os.path.join(shard_dir, shard['file']) for shard in self.manifest['shards']]
+        self.num_samples = sum(shard['num_samples'] for shard in self.manifest['shards'])
+        # Position of the first sample of each shard in the manifest, to index samples whatever the shard order
+        self.file_offsets, offset = {}, 0
+        for file, shard in zip(self.files, self.manifest['shards']):
+            self.file_offsets[file] = offset
+            offset += shard['num_samples']
+        self.minority_set = set(int(c) for c in minority_classes)
+        self.train = train
+        self.transform = transform
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.compact = compact
+        self.crop_size = crop_size
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        files, row_step, row_offset, rng = assign_worker_shards(self.files, self.shuffle)
+
+        samples = self._iter_samples(files, row_step, row_offset)
+        if self.shuffle:
+            samples = shuffle_buffer(samples, self.shuffle_buffer, rng)
+
+        for sample in samples:
+            yield sample
+
+    def _iter_samples(self, files, row_step, row_offset):
+        row = 0
+        for file in files:
+            index = self.file_offsets[file]
+            for members in _iter_tar_samples(file):
+                if row % row_step == row_offset:
+                    label = int(members['cls'])
+                    image_buffer = next(data for ext, data in members.items() if ext not in ('cls', 'json'))
+                    data = decode_image_tensor(image_buffer, self.compact)
+                    augment = not self.train or label in self.minority_set
+                    data = transform_sample(data, self.transform, augment, self.crop_size)
+                    yield {"image": data, "label": torch.tensor(label), "index": index}
+                row += 1
+                index += 1
+
+
+def _iter_tar_samples(file: str) -> Iterator:
+    """
+    Read a tar shard sequentially and yield the members of each sample as a dictionnary {extension: bytes}.
+    """
+    key, members = None, {}
+    # Stream mode: the file is read once, front to back
+    with tarfile.open(file, mode='r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            member_key, extension = member.name.split('.', 1)
+            if member_key != key and members:
+                yield members
+                members = {}
+            key = member_key
+            members[extension] = tar.extractfile(member).read()
+
+    if members:
+        yield members
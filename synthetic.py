@@ -0,0 +1,367 @@
+import io
+import os
+import json
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import datasets
+import numpy as np
+import pandas as pd
+
+from PIL import Image
+
+
+# Number of images of each class in HAM10000
+HAM10000_CLASS_COUNTS = {
+    'nv': 6705,
+    'mel': 1113,
+    'bkl': 1099,
+    'bcc': 514,
+    'akiec': 327,
+    'vasc': 142,
+    'df': 115
+}
+
+# Mean RGB color of the synthetic lesions of each class
+LESION_COLORS = {
+    'nv': (120, 80, 60),
+    'mel': (60, 40, 35),
+    'bkl': (150, 110, 80),
+    'bcc': (190, 130, 130),
+    'akiec': (170, 90, 80),
+    'vasc': (160, 40, 60),
+    'df': (140, 100, 90)
+}
+
+SKIN_COLOR = (215, 165, 140)
+
+DX_TYPES = ['histo', 'follow_up', 'consensus', 'confocal']
+SEXES = ['male', 'female', 'unknown']
+LOCALIZATIONS = [
+    'back', 'lower extremity', 'trunk', 'upper extremity', 'abdomen', 'face', 'chest',
+    'foot', 'unknown', 'neck', 'scalp', 'hand', 'ear', 'genital', 'acral'
+]
+
+METADATA_FILE = 'HAM10000_metadata.csv'
+IMAGES_DIR = 'HAM10000_images'
+
+
+def generate_metadata(
+        scale: float = 1.0,
+        split_fractions: tuple = (0.8, 0.1, 0.1),
+        seed: int = 0
+    ) -> pd.DataFrame:
+    """
+    Generate the metadata of a synthetic HAM10000-like dataset: lesion_id, image_id, dx, dx_type, age, sex,
+    localization and split. Classes keep the HAM10000 imbalance, and images of a same lesion
+    (1 to 3 per lesion) are in the same split.
+
+    Parameters
+    ----------
+    scale : float, default 1.0
+        Size of the dataset relative to HAM10000 (10015 images)
+    split_fractions : tuple, default (0.8, 0.1, 0.1)
+        Fractions of lesions in the train, validation and test sets
+    seed : int, default 0
+        Random seed
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+
+    rows = []
+    for dx, count in HAM10000_CLASS_COUNTS.items():
+        n_images = max(int(round(count * scale)), 1)
+        while n_images > 0:
+            # About 1.3 images per lesion, as in HAM10000
+            lesion_size = min(int(rng.choice([1, 2, 3], p=[0.75, 0.17, 0.08])), n_images)
+            split = rng.choice(['train', 'validation', 'test'], p=split_fractions)
+            rows.extend({'dx': dx, 'lesion': len(rows), 'split': split} for _ in range(lesion_size))
+            n_images -= lesion_size
+
+    metadata = pd.DataFrame(rows)
+    n = len(metadata)
+    metadata['lesion_id'] = [f"HAM_{lesion:07d}" for lesion in metadata.pop('lesion')]
+
+    # Images in random order, with unique ids
+    metadata = metadata.iloc[rng.permutation(n)].reset_index(drop=True)
+    metadata['image_id'] = [f"ISIC_{idx:07d}" for idx in range(n)]
+
+    metadata['dx_type'] = rng.choice(DX_TYPES, size=n, p=[0.53, 0.37, 0.09, 0.01])
+    # Ages are multiples of 5
+    age = (rng.normal(52, 17, size=n).clip(0, 85) / 5).round() * 5
+    age[rng.random(n) < 0.005] = np.nan
+    metadata['age'] = age
+    metadata['sex'] = rng.choice(SEXES, size=n, p=[0.54, 0.455, 0.005])
+    metadata['localization'] = rng.choice(LOCALIZATIONS, size=n)
+
+    return metadata[['lesion_id', 'image_id', 'dx', 'dx_type', 'age', 'sex', 'localization', 'split']]
+
+
+def synthetic_image(
+        dx: str,
+        image_idx: int,
+        seed: int = 0,
+        image_size: tuple = (600, 450)
+    ) -> Image.Image:
+    """
+    Draw a synthetic dermatoscopic image: a noisy elliptic lesion of the class color on a skin background.
+    The image only depends on dx, image_idx and seed.
+
+    Parameters
+    ----------
+    dx : str
+        Class of the lesion
+    image_idx : int
+        Index of the image in the dataset
+    seed : int, default 0
+        Random seed of the dataset
+    image_size : tuple, default (600, 450)
+        Width and height
+
+    Returns
+    -------
+    Image.Image
+    """
+    rng = np.random.default_rng([seed, image_idx])
+    width, height = image_size
+
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    center_x = width / 2 + rng.normal(0, width / 12)
+    center_y = height / 2 + rng.normal(0, height / 12)
+    radius_x, radius_y = rng.uniform(0.12, 0.35) * width, rng.uniform(0.12, 0.35) * height
+    angle = rng.uniform(0, np.pi)
+
+    # Rotated ellipse with a soft border
+    offset_x, offset_y = x - center_x, y - center_y
+    u = (offset_x * np.cos(angle) + offset_y * np.sin(angle)) / radius_x
+    v = (-offset_x * np.sin(angle) + offset_y * np.cos(angle)) / radius_y
+    mask = np.clip((1 - (u ** 2 + v ** 2)) * 4, 0, 1)[..., None]
+
+    skin = np.asarray(SKIN_COLOR, dtype=np.float32) + rng.normal(0, 10, 3)
+    lesion = np.asarray(LESION_COLORS[dx], dtype=np.float32) + rng.normal(0, 12, 3)
+    image = skin * (1 - mask) + lesion * mask + rng.normal(0, 6, (height, width, 3))
+
+    return Image.fromarray(image.clip(0, 255).astype(np.uint8))
+
+
+def encode_synthetic_image(dx, image_idx, seed, image_size, quality) -> bytes:
+    """
+    Draw a synthetic image and encode it as JPEG.
+    """
+    buffer = io.BytesIO()
+    synthetic_image(dx, image_idx, seed, image_size).save(buffer, format='JPEG', quality=quality)
+
+    return buffer.getvalue()
+
+
+def write_local_dataset(
+        metadata: pd.DataFrame,
+        output_dir: str,
+        seed: int = 0,
+        image_size: tuple = (600, 450),
+        quality: int = 90,
+        num_proc: int = None
+    ) -> str:
+    """
+    Write a synthetic dataset in the local folder layout read by load_local_dataset:
+    <output_dir>/HAM10000_images/<image_id>.jpg and <output_dir>/HAM10000_metadata.csv with a split column.
+
+    Returns
+    -------
+    str : output_dir
+    """
+    images_dir = os.path.join(output_dir, IMAGES_DIR)
+    os.makedirs(images_dir, exist_ok=True)
+
+    tasks = [
+        (os.path.join(images_dir, f"{image_id}.jpg"), dx, idx, seed, image_size, quality)
+        for idx, (image_id, dx) in enumerate(zip(metadata['image_id'], metadata['dx']))
+    ]
+    if num_proc is None or num_proc <= 1:
+        for task in tasks:
+            _write_image(task)
+    else:
+        with ProcessPoolExecutor(max_workers=num_proc) as executor:
+            for _ in executor.map(_write_image, tasks, chunksize=64):
+                pass
+
+    # Metadata is written last, a complete image folder is found next to it
+    metadata.to_csv(os.path.join(output_dir, METADATA_FILE), index=False)
+
+    return output_dir
+
+
+def _write_image(task):
+    path, dx, image_idx, seed, image_size, quality = task
+    with open(path, 'wb') as f:
+        f.write(encode_synthetic_image(dx, image_idx, seed, image_size, quality))
+
+
+def write_huggingface_dataset(
+        metadata: pd.DataFrame,
+        output_dir: str,
+        seed: int = 0,
+        image_size: tuple = (600, 450),
+        quality: int = 90,
+        num_proc: int = None
+    ) -> str:
+    """
+    Write a synthetic dataset as a HuggingFace DatasetDict saved with save_to_disk,
+    with the columns of marmal88/skin_cancer (image, image_id, lesion_id, dx, dx_type, age, sex, localization).
+
+    Returns
+    -------
+    str : output_dir
+    """
+    features = datasets.Features({
+        'image': datasets.Image(),
+        'image_id': datasets.Value('string'),
+        'lesion_id': datasets.Value('string'),
+        'dx': datasets.Value('string'),
+        'dx_type': datasets.Value('string'),
+        'age': datasets.Value('float64'),
+        'sex': datasets.Value('string'),
+        'localization': datasets.Value('string')
+    })
+
+    # Generated splits are written to a temporary cache, not to the HuggingFace cache
+    tmp_dir = tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_dir)))
+    splits = {}
+    for part_set in ('train', 'validation', 'test'):
+        rows = metadata.index[metadata['split'] == part_set].tolist()
+        # The list of rows is split into one generator shard per process
+        n_shards = max(1, min(num_proc or 1, len(rows)))
+        splits[part_set] = datasets.Dataset.from_generator(
+            _generate_rows,
+            features=features,
+            gen_kwargs={
+                'rows': rows,
+                'metadata': metadata,
+                'seed': seed,
+                'image_size': image_size,
+                'quality': quality
+            },
+            num_proc=n_shards if n_shards > 1 else None,
+            cache_dir=tmp_dir.name
+        )
+
+    datasets.DatasetDict(splits).save_to_disk(output_dir)
+    del splits
+    tmp_dir.cleanup()
+
+    return output_dir
+
+
+def _generate_rows(rows, metadata, seed, image_size, quality):
+    for idx in rows:
+        row = metadata.loc[idx]
+        image = encode_synthetic_image(row['dx'], idx, seed, image_size, quality)
+        yield {
+            'image': {'bytes': image, 'path': f"{row['image_id']}.jpg"},
+            'image_id': row['image_id'],
+            'lesion_id': row['lesion_id'],
+            'dx': row['dx'],
+            'dx_type': row['dx_type'],
+            'age': None if pd.isna(row['age']) else float(row['age']),
+            'sex': row['sex'],
+            'localization': row['localization']
+        }
+
+
+def generate_synthetic_dataset(
+        output_dir: str,
+        scale: float = 1.0,
+        layout: str = 'both',
+        image_size: tuple = (600, 450),
+        quality: int = 90,
+        split_fractions: tuple = (0.8, 0.1, 0.1),
+        seed: int = 0,
+        num_proc: int = None
+    ) -> dict:
+    """
+    Generate a synthetic HAM10000-like dataset, to run the data pipeline and training without network access.
+    The same images and metadata are written in the local folder layout (<output_dir>/local)
+    and/or the HuggingFace save_to_disk layout (<output_dir>/huggingface).
+    Both directories can be given as dataset to generate_dataloader.
+
+    Parameters
+    ----------
+    output_dir : str
+        Output directory
+    scale : float, default 1.0
+        Size of the dataset relative to HAM10000 (10015 images), e.g. 10 or 100
+    layout : {'both', 'local', 'huggingface'}, default 'both'
+        Layouts to write
+    image_size : tuple, default (600, 450)
+        Width and height of the images
+    quality : int, default 90
+        JPEG quality
+    split_fractions : tuple, default (0.8, 0.1, 0.1)
+        Fractions of lesions in the train, validation and test sets
+    seed : int, default 0
+        Random seed
+    num_proc : int, default None
+        Number of processes drawing the images
+
+    Returns
+    -------
+    dict : Path of each written layout
+
+    Example
+    -------
+    >>> paths = generate_synthetic_dataset('synthetic_1x', scale=1.0)
+    >>> generate_dataloader(dataset=paths['huggingface'], part_set='train', ...)
+    """
+    if layout not in ('both', 'local', 'huggingface'):
+        raise ValueError(f"Unknown layout '{layout}', expected 'both', 'local' or 'huggingface'")
+
+    metadata = generate_metadata(scale, split_fractions, seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    paths = {}
+    kwargs = {'seed': seed, 'image_size': image_size, 'quality': quality, 'num_proc': num_proc}
+    if layout in ('both', 'local'):
+        paths['local'] = write_local_dataset(metadata, os.path.join(output_dir, 'local'), **kwargs)
+    if layout in ('both', 'huggingface'):
+        paths['huggingface'] = write_huggingface_dataset(metadata, os.path.join(output_dir, 'huggingface'), **kwargs)
+
+    with open(os.path.join(output_dir, 'synthetic.json'), 'w') as f:
+        json.dump({
+            'scale': scale,
+            'seed': seed,
+            'image_size': list(image_size),
+            'quality': quality,
+            'num_samples': len(metadata),
+            'class_counts': metadata['dx'].value_counts().to_dict(),
+            'split_counts': metadata['split'].value_counts().to_dict()
+        }, f, indent=2)
+
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic HAM10000-like dataset.")
+    parser.add_argument('output_dir')
+    parser.add_argument('--scale', type=float, default=1.0, help="Size relative to HAM10000 (10015 images)")
+    parser.add_argument('--layout', choices=['both', 'local', 'huggingface'], default='both')
+    parser.add_argument('--width', type=int, default=600)
+    parser.add_argument('--height', type=int, default=450)
+    parser.add_argument('--quality', type=int, default=90)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--num-proc', type=int, default=None)
+    args = parser.parse_args()
+
+    paths = generate_synthetic_dataset(
+        output_dir=args.output_dir,
+        scale=args.scale,
+        layout=args.layout,
+        image_size=(args.width, args.height),
+        quality=args.quality,
+        seed=args.seed,
+        num_proc=args.num_proc
+    )
+    print(json.dumps(paths, indent=2))
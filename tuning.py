@@ -0,0 +1,225 @@
+from typing import Callable, Union
+
+import os
+import copy
+import json
+import time
+import socket
+import itertools
+
+import torch
+from torch.utils.data import Dataset
+import torch.nn as nn
+import torch.nn.functional as F
+
+from models import to_float_image
+from preprocessing import create_dataloader
+
+
+def autotune_dataloader(
+        dataset: Dataset,
+        model: nn.Module = None,
+        device: torch.device = None,
+        batch_sizes: tuple = (32, 64, 128),
+        num_workers: tuple = (0, 2, 4, 8),
+        prefetch_factors: tuple = (2, 4),
+        n_batches: int = 20,
+        warmup_batches: int = 3,
+        collate_fn: Callable = None,
+        save_path: str = None,
+        verbose: bool = False
+    ) -> dict:
+    """
+    Run short timed trials of the input pipeline and return the fastest DataLoader configuration.
+    For each configuration, the time spent waiting for batches is separated from the time spent in the model
+    (forward and backward pass). Configurations are ranked by samples per second.
+
+    Parameters
+    ----------
+    dataset : Dataset
+        Dataset to load, as returned by create_torch_dataset
+    model : nn.Module, default None
+        Model consuming the batches, left unchanged: trials run on a copy. None to only measure the input pipeline.
+    device : torch.device, default None
+        Calculation device. Defaults to cuda if available.
+    batch_sizes : tuple
+        Batch sizes to try
+    num_workers : tuple
+        Numbers of worker processes to try
+    prefetch_factors : tuple
+        Prefetch factors to try (only with worker processes)
+    n_batches : int, default 20
+        Number of timed batches per trial
+    warmup_batches : int, default 3
+        Number of batches loaded before timing, to exclude workers startup
+    collate_fn : Callable, default None
+        Collate function, such as a BatchAugmentation
+    save_path : str, default None
+        JSON file where the best configuration of this machine is saved
+    verbose : bool, default False
+        Print each trial result
+
+    Returns
+    -------
+    dict : best configuration and all trials
+
+    Example
+    -------
+    >>> train_dataloader = generate_dataloader(...)
+    >>> model = ResNet18(num_classes=7).to(device)
+    >>> results = autotune_dataloader(
+    >>>     dataset=train_dataloader.dataset,
+    >>>     model=model,
+    >>>     device=device,
+    >>>     save_path='dataloader_config.json'
+    >>> )
+    >>> generate_dataloader(..., **results['best'])
+    """
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    configs = [
+        {'batch_size': batch_size, 'num_workers': workers, 'prefetch_factor': prefetch}
+        for batch_size, workers in itertools.product(batch_sizes, num_workers)
+        for prefetch in (prefetch_factors if workers > 0 else (None,))
+    ]
+
+    # Trials run on a copy: the backward passes would change the BatchNorm statistics and gradients of the model
+    trial_model = copy.deepcopy(model) if model is not None else None
+
+    trials = []
+    for config in configs:
+        trial = {**config, **_time_trial(dataset, trial_model, device, config, n_batches, warmup_batches, collate_fn)}
+        trials.append(trial)
+        if verbose:
+            print("batch_size={batch_size} num_workers={num_workers} prefetch_factor={prefetch_factor} : "
+                  "{samples_per_sec:.1f} samples/s, data wait {data_wait_fraction:.0%}".format(**trial))
+
+    best_trial = max(trials, key=lambda trial: trial['samples_per_sec'])
+    best = {key: best_trial[key] for key in ('batch_size', 'num_workers', 'prefetch_factor')}
+    best['persistent_workers'] = best['num_workers'] > 0
+    best['pin_memory'] = device.type == 'cuda'
+
+    if save_path is not None:
+        save_tuned_config(best, save_path)
+
+    return {'best': best, 'trials': trials}
+
+
+def _time_trial(dataset, model, device, config, n_batches, warmup_batches, collate_fn):
+    """
+    Time one DataLoader configuration.
+    """
+    dataloader = create_dataloader(
+        dataset=dataset,
+        batch_size=config['batch_size'],
+        shuffle=True,
+        collate_fn=collate_fn,
+        num_workers=config['num_workers'],
+        prefetch_factor=config['prefetch_factor'],
+        pin_memory=device.type == 'cuda'
+    )
+
+    data_time, model_time, n_samples, n_timed = 0.0, 0.0, 0, 0
+    iterator = iter(dataloader)
+
+    for batch_idx in range(warmup_batches + n_batches):
+        start = time.perf_counter()
+        try:
+            sample = next(iterator)
+        except StopIteration:
+            # Dataset smaller than the trial, start a new epoch
+            iterator = iter(dataloader)
+            sample = next(iterator)
+        data = to_float_image(sample['image'].to(device, non_blocking=True))
+        label = sample['label'].to(device, non_blocking=True)
+        # Wait for the copies to the device, which are part of the data loading time
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        loaded = time.perf_counter()
+
+        if model is not None:
+            loss = F.cross_entropy(model(data), label)
+            loss.backward()
+            model.zero_grad(set_to_none=True)
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        done = time.perf_counter()
+
+        # Warmup batches include workers startup
+        if batch_idx >= warmup_batches:
+            data_time += loaded - start
+            model_time += done - loaded
+            n_samples += len(label)
+            n_timed += 1
+
+    del iterator
+
+    total_time = data_time + model_time
+
+    return {
+        'samples_per_sec': n_samples / total_time if total_time > 0 else 0.0,
+        'data_wait_fraction': data_time / total_time if total_time > 0 else 0.0,
+        'data_time_per_batch': data_time / n_timed,
+        'model_time_per_batch': model_time / n_timed
+    }
+
+
+def machine_key() -> str:
+    """
+    Return a key identifying the current machine type: host name, number of CPUs and GPU name.
+    """
+    gpu = torch.cuda.get_device_name(0) if torch.cuda.is_available() else 'cpu'
+
+    return f"{socket.gethostname()}-{os.cpu_count()}cpu-{gpu}"
+
+
+def save_tuned_config(config: dict, path: str) -> None:
+    """
+    Save a DataLoader configuration for the current machine in a JSON file.
+    Configurations of other machines in the file are kept.
+
+    Parameters
+    ----------
+    config : dict
+        DataLoader configuration
+    path : str
+        JSON file
+    """
+    configs = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            configs = json.load(f)
+
+    configs[machine_key()] = config
+
+    with open(path, 'w') as f:
+        json.dump(configs, f, indent=2)
+
+
+def load_tuned_config(path: str) -> Union[dict, None]:
+    """
+    Load the DataLoader configuration of the current machine from a JSON file.
+    Return None if the machine has not been tuned.
+
+    Parameters
+    ----------
+    path : str
+        JSON file
+
+    Returns
+    -------
+    dict or None
+
+    Example
+    -------
+    >>> config = load_tuned_config('dataloader_config.json')
+    >>> generate_dataloader(..., **config)
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        configs = json.load(f)
+
+    return configs.get(machine_key())